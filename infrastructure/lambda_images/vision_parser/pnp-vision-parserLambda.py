@@ -1,67 +1,554 @@
+import time
+_import_started = time.perf_counter()
 import os
+import re
 import json
-import boto3
-import time
-from google import genai
-from google.genai import types
-from PIL import Image
+import hashlib
+import importlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timezone, timedelta
+from urllib.parse import unquote_plus
 import io
 
+# Cold start: google.genai, PIL, boto3 and botocore are imported on first use, every client
+# is built on first use and key health is only read from S3 once an invocation calls
+# Gemini, so bursts of skipped or cached pages never pay for them.
+# init_profile records each step; the first invocation of a container prints it.
+init_profile = OrderedDict()
+_lazy_lock = threading.RLock()
+
+class LazyImport:
+    """
+    Stands in for a module and imports it on first attribute access.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with _lazy_lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    self._module = importlib.import_module(self._name)
+                    init_profile[f"import {self._name}"] = time.perf_counter() - started
+        return getattr(self._module, attr)
+
+class LazyClient:
+    """
+    Stands in for a boto3 client and creates it on first use.
+    """
+    def __init__(self, service):
+        self._service = service
+        self._client = None
+
+    def __getattr__(self, attr):
+        if self._client is None:
+            with _lazy_lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    self._client = boto3.client(self._service)
+                    init_profile[f"boto3 client {self._service}"] = time.perf_counter() - started
+        return getattr(self._client, attr)
+
+boto3 = LazyImport("boto3")
+botocore_exceptions = LazyImport("botocore.exceptions")
+genai = LazyImport("google.genai")
+types = LazyImport("google.genai.types")
+Image = LazyImport("PIL.Image")
+
 # S3 Configuration from environment variables
 S3_BUCKET = os.environ.get("S3_BUCKET_NAME")
+IMAGE_PREFIX = "data/interim/images/PnP/"
 OUTPUT_PREFIX = "data/pro/json/PnP/"
+# Existence index: one paginated listing per prefix replaces a HEAD per output key.
+# Optionally persisted so the next run loads one object instead of listing the prefix.
+# A manifest is only trusted for EXISTENCE_MANIFEST_MAX_AGE_SECONDS after the listing it
+# came from (less than one daily run), so keys deleted since then are picked up again.
+EXISTENCE_MANIFEST_PREFIX = "data/manifests/existence/"
+USE_EXISTENCE_MANIFEST = os.environ.get("USE_EXISTENCE_MANIFEST", "false").lower() == "true"
+EXISTENCE_MANIFEST_MAX_AGE_SECONDS = int(os.environ.get("EXISTENCE_MANIFEST_MAX_AGE_SECONDS", "72000"))
 GEMINI_API_KEY_SSM_NAME = os.environ.get("GEMINI_API_KEY_SSM_NAME", "/SpecialsID/gemini_api_key")
 
 MODELS = ["gemini-2.5-flash-lite", "gemini-2.0-flash-lite", "gemini-2.5-flash", "gemini-2.0-flash", "gemini-3-flash-preview"]
-s3_client = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-lambda_client = boto3.client('lambda')
+# The converter tags each page ("page-type" metadata). Pages with no products are written
+# as an empty array without a Gemini call; down-tiered pages only get the cheapest model.
+# Only blank pages are skipped by default: a text-layer "legal" tag can't prove a page has
+# no image-only prices, so legal pages still get one cheap pass.
+SKIP_PAGE_TYPES = {t.strip() for t in os.environ.get("SKIP_PAGE_TYPES", "blank").split(",") if t.strip()}
+DOWN_TIER_PAGE_TYPES = {t.strip() for t in os.environ.get("DOWN_TIER_PAGE_TYPES", "cover,legal").split(",") if t.strip()}
+
+# Request scheduler: pages run concurrently and every (API key, model) pair gets its own
+# token buckets sized to that model's tier, so throughput scales with the number of keys.
+# The buckets live in one container, so each gets 1/PARSER_WORKERS of the tier: with
+# PARSER_WORKERS queue workers running at once the key's quota is shared, not multiplied.
+# Override the limits with MODEL_LIMITS_JSON, e.g. {"gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000}}
+MODEL_LIMITS = {
+    "gemini-2.5-flash-lite": {"rpm": 15, "tpm": 250000},
+    "gemini-2.0-flash-lite": {"rpm": 30, "tpm": 1000000},
+    "gemini-2.5-flash": {"rpm": 10, "tpm": 250000},
+    "gemini-2.0-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-3-flash-preview": {"rpm": 10, "tpm": 250000},
+}
+MODEL_LIMITS.update(json.loads(os.environ.get("MODEL_LIMITS_JSON", "{}")))
+DEFAULT_MODEL_LIMITS = {"rpm": 10, "tpm": 250000}
+PARSER_WORKERS = max(1, int(os.environ.get("PARSER_WORKERS", "1")))
+ESTIMATED_TOKENS_PER_PAGE = int(os.environ.get("ESTIMATED_TOKENS_PER_PAGE", "2000"))
+PARSER_CONCURRENCY = int(os.environ.get("PARSER_CONCURRENCY", "8"))
+MAX_LIMITER_WAIT_SECONDS = float(os.environ.get("MAX_LIMITER_WAIT_SECONDS", "30"))
+
+# Key/model health: 429s and 5xx put a (key, model) pair on cooldown (the server's retry
+# delay when it gives one), and repeated failures open a circuit breaker on the pair.
+# The state is shared through S3 so warm containers and later discovery batches see it.
+HEALTH_STATE_KEY = "data/manifests/vision_parser/key_health.json"
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.environ.get("RATE_LIMIT_COOLDOWN_SECONDS", "60"))
+SERVER_ERROR_COOLDOWN_SECONDS = float(os.environ.get("SERVER_ERROR_COOLDOWN_SECONDS", "10"))
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_THRESHOLD", "3"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "300"))
+# Parse cache: Gemini results keyed on (page bytes hash, SYSTEM_INSTRUCTION hash, model).
+# The same flyer page under another province or on a rerun reuses the stored JSON.
+# Entries older than PARSE_CACHE_TTL_DAYS are ignored; a bucket lifecycle rule on the
+# prefix (main.tf) deletes them. Queue workers claim a page hash before calling Gemini,
+# so the same page arriving under nine provinces at once is parsed once: the others are
+# requeued PARSE_CLAIM_WAIT_SECONDS later and find the cache entry. A claim older than
+# PARSE_CLAIM_TTL_SECONDS is treated as abandoned and taken over.
+PARSE_CACHE_PREFIX = "data/interim/parse_cache/PnP/"
+USE_PARSE_CACHE = os.environ.get("USE_PARSE_CACHE", "true").lower() == "true"
+PARSE_CACHE_TTL_DAYS = float(os.environ.get("PARSE_CACHE_TTL_DAYS", "30"))
+PARSE_CLAIM_TTL_SECONDS = int(os.environ.get("PARSE_CLAIM_TTL_SECONDS", "900"))
+PARSE_CLAIM_WAIT_SECONDS = int(os.environ.get("PARSE_CLAIM_WAIT_SECONDS", "60"))
+PARSE_CACHE_MEMORY_ENTRIES = int(os.environ.get("PARSE_CACHE_MEMORY_ENTRIES", "256"))
+# Pages are sent to Gemini as the bytes the converter wrote. Pixels are only decoded when
+# the page is larger than MAX_IMAGE_LONG_EDGE (0 = never resize). MEASURE_DECODE_SAVINGS
+# times the old PIL decode/re-encode round trip per page so the CPU saved can be logged.
+MAX_IMAGE_LONG_EDGE = int(os.environ.get("MAX_IMAGE_LONG_EDGE", "0"))
+MEASURE_DECODE_SAVINGS = os.environ.get("MEASURE_DECODE_SAVINGS", "false").lower() == "true"
+# Cascade: every answer is scored (schema violations, unparseable prices, how much of the
+# page the product boxes cover, and how many products that area holds) and only pages
+# scoring below CASCADE_MIN_SCORE escalate to the next model. Pages that never clear the
+# bar keep the best answer seen.
+CASCADE_MIN_SCORE = float(os.environ.get("CASCADE_MIN_SCORE", "0.6"))
+CASCADE_MIN_COVERAGE = float(os.environ.get("CASCADE_MIN_COVERAGE", "0.3"))
+# Products expected per whole page of box area, by converter page type. A few large
+# boxes on a product grid (one box over a third of the page) score low however much of
+# the page they cover. Override with PRODUCT_DENSITY_JSON, e.g. {"product_grid": 10}.
+PRODUCT_DENSITY = {"product_grid": 8, "cover": 2, "legal": 2, "unknown": 5}
+PRODUCT_DENSITY.update(json.loads(os.environ.get("PRODUCT_DENSITY_JSON", "{}")))
+# Hero pages hold a few large products: the expectation never exceeds this many, so three
+# well-formed boxes over most of a grid page pass while a single large box still doesn't.
+PRODUCT_DENSITY_CAP = float(os.environ.get("PRODUCT_DENSITY_CAP", "3"))
+
+# Time budget: a page only starts when its predicted duration fits in the remaining
+# invocation time. Predictions come from a rolling window of call latencies per model
+# and image size, weighted by how often each model escalates in the cascade.
+PAGE_LATENCY_WINDOW = int(os.environ.get("PAGE_LATENCY_WINDOW", "50"))
+DEFAULT_CALL_SECONDS = float(os.environ.get("DEFAULT_CALL_SECONDS", "30"))
+TIME_BUDGET_MARGIN_SECONDS = float(os.environ.get("TIME_BUDGET_MARGIN_SECONDS", "10"))
+
+# Context caching: SYSTEM_INSTRUCTION is uploaded once per (API key, model) as cached
+# content and referenced by name, refreshed before its TTL runs out. Prompts below the
+# model's caching minimum, or any cache error, fall back to sending the prompt inline.
+# GEMINI_FAKE_CLIENT swaps the SSM keys for FakeGenaiClient so this runs offline.
+USE_CONTEXT_CACHE = os.environ.get("USE_CONTEXT_CACHE", "true").lower() == "true"
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_REFRESH_SECONDS = int(os.environ.get("CONTEXT_CACHE_REFRESH_SECONDS", "300"))
+CONTEXT_CACHE_RETRY_SECONDS = int(os.environ.get("CONTEXT_CACHE_RETRY_SECONDS", "3600"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+GEMINI_FAKE_CLIENT = os.environ.get("GEMINI_FAKE_CLIENT", "false").lower() == "true"
+
+# Tiling: dense pages are split into a TILE_GRID of overlapping tiles that are parsed
+# concurrently; tile boxes are mapped back to page coordinates and products seen twice
+# across a seam are merged, so the page JSON keeps its usual shape.
+# TILE_MODE: off, dense (only pages the converter tagged product_grid) or all.
+TILE_MODE = os.environ.get("TILE_MODE", "off")
+TILE_GRID = tuple(int(n) for n in os.environ.get("TILE_GRID", "2x2").lower().split("x"))  # columns x rows
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", "0.1"))
+TILE_DEDUP_OVERLAP = float(os.environ.get("TILE_DEDUP_OVERLAP", "0.5"))
+# Tiles over headers and banners are often empty: a tile's [] is only escalated this many
+# times before it is settled, and a page whose tiles are all empty is written as [].
+TILE_EMPTY_ESCALATIONS = int(os.environ.get("TILE_EMPTY_ESCALATIONS", "1"))
+TILED_CACHE_MODEL = f"tiled-{TILE_GRID[0]}x{TILE_GRID[1]}"
+
+# Batching: BATCH_PAGES > 1 sends that many pages of one flyer per Gemini request and
+# splits the keyed answer back into page_N.json outputs.
+BATCH_PAGES = int(os.environ.get("BATCH_PAGES", "1"))
+# Work queue: discovery is a planner that diffs the image and JSON prefixes and queues
+# every pending page; workers (this function behind an SQS event source mapping) drain
+# it in parallel and report per-page failures so nothing is dropped. Without
+# WORK_QUEUE_URL the planner drains a LocalWorkQueue in-process.
+WORK_QUEUE_URL = os.environ.get("WORK_QUEUE_URL")
+QUEUE_SEND_BATCH = 10  # SQS SendMessageBatch limit
+
+# Batch-job mode for backfills: every pending page under a prefix is uploaded through the
+# Files API and referenced from one Gemini batch job (batch-tier quota and price), so the
+# request file stays small. An EventBridge schedule ({"batch_poll": true}) checks the open
+# jobs and fans finished ones out into the normal JSON keys. BATCH_ENDPOINT=local swaps in
+# LocalBatchEndpoint, which answers offline.
+BATCH_JOB_PREFIX = "data/manifests/vision_parser/batch_jobs/"
+BATCH_DONE_PREFIX = f"{BATCH_JOB_PREFIX}done/"
+BATCH_MODEL = os.environ.get("BATCH_MODEL", MODELS[0])
+BATCH_ENDPOINT = os.environ.get("BATCH_ENDPOINT", "gemini")
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+IMAGE_MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+RETRY_DELAY_PATTERN = re.compile(r"retry(?:Delay)?['\"]?\s*(?::|in)?\s*['\"]?([\d.]+)s", re.IGNORECASE)
+s3_client = LazyClient('s3')
+ssm_client = LazyClient('ssm')
+sqs_client = LazyClient('sqs')
+
+_existing_keys = {}  # prefix -> set of keys, rebuilt once per invocation
+_listed_at = {}  # prefix -> when the keys in _existing_keys were listed
+
+def existence_manifest_key(prefix):
+    return f"{EXISTENCE_MANIFEST_PREFIX}{prefix.strip('/').replace('/', '_')}.json"
+
+def load_existence_manifest(prefix):
+    """
+    Returns (listed_at, keys) from the persisted manifest, or (None, None) when there is
+    none or it is older than EXISTENCE_MANIFEST_MAX_AGE_SECONDS.
+    """
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=existence_manifest_key(prefix))
+    except botocore_exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        return None, None
+    manifest = json.loads(response['Body'].read())
+    # Manifests written before listed_at existed can't be aged, so they are never trusted
+    listed_at = manifest.get("listed_at") if isinstance(manifest, dict) else None
+    if listed_at is None or time.time() - listed_at > EXISTENCE_MANIFEST_MAX_AGE_SECONDS:
+        return None, None
+    return listed_at, set(manifest["keys"])
+
+def build_existence_index(prefix):
+    """
+    Lists every key under the prefix once and keeps it as an in-memory set,
+    so skip checks for that prefix never touch the network again.
+    """
+    keys = set()
+    if S3_BUCKET and USE_EXISTENCE_MANIFEST:
+        listed_at, manifest_keys = load_existence_manifest(prefix)
+        if manifest_keys is not None:
+            _existing_keys[prefix] = manifest_keys
+            _listed_at[prefix] = listed_at
+            print(f"📇 Loaded existence manifest for {prefix} ({len(manifest_keys)} keys, {time.time() - listed_at:.0f}s old)")
+            return manifest_keys
+    listed_at = time.time()
+    if S3_BUCKET:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                keys.add(obj['Key'])
+    _existing_keys[prefix] = keys
+    _listed_at[prefix] = listed_at
+    print(f"📇 Indexed {len(keys)} existing keys under {prefix}")
+    return keys
+
+def save_existence_manifest(prefix):
+    """
+    Persists the index, merged with whatever another invocation saved meanwhile. The
+    merged manifest keeps the older listing time, so it expires with its oldest part.
+    """
+    if not (S3_BUCKET and USE_EXISTENCE_MANIFEST) or prefix not in _existing_keys:
+        return
+    try:
+        keys, listed_at = set(_existing_keys[prefix]), _listed_at[prefix]
+        other_listed_at, other_keys = load_existence_manifest(prefix)
+        if other_keys is not None:
+            keys |= other_keys
+            listed_at = min(listed_at, other_listed_at)
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=existence_manifest_key(prefix),
+            Body=json.dumps({"listed_at": listed_at, "keys": sorted(keys)}),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Failed to save existence manifest for {prefix}: {e}")
+
+def mark_exists(key):
+    for prefix, keys in _existing_keys.items():
+        if key.startswith(prefix):
+            keys.add(key)
 
 def file_exists_in_s3(bucket, key):
+    for prefix, keys in _existing_keys.items():
+        if key.startswith(prefix):
+            return key in keys
+    # Key is not covered by an index (single S3 event), fall back to a HEAD
     try:
         s3_client.head_object(Bucket=bucket, Key=key)
         return True
     except:
         return False
 
-# Global client to be initialized lazily
+# Global client to be initialized lazily. The decrypted key list is re-read from SSM
+# after API_KEYS_TTL_SECONDS; clients are only rebuilt when the keys actually changed.
+API_KEYS_TTL_SECONDS = int(os.environ.get("API_KEYS_TTL_SECONDS", "900"))
 _genai_clients = []
-_current_client_index = 0
+_genai_keys_fingerprint = None
+_genai_keys_loaded_at = 0
+_clients_lock = threading.Lock()
 
 def get_genai_clients():
-    global _genai_clients
-    if not _genai_clients:
+    global _genai_clients, _genai_keys_fingerprint, _genai_keys_loaded_at
+    with _clients_lock:
+        if not _genai_clients and GEMINI_FAKE_CLIENT:
+            _genai_clients = [FakeGenaiClient(), FakeGenaiClient()]
+            _genai_keys_loaded_at = float("inf")
+        if _genai_clients and time.time() - _genai_keys_loaded_at < API_KEYS_TTL_SECONDS:
+            return _genai_clients
+
         print(f"Fetching API keys from SSM: {GEMINI_API_KEY_SSM_NAME}")
         try:
+            started = time.perf_counter()
             response = ssm_client.get_parameter(
                 Name=GEMINI_API_KEY_SSM_NAME,
                 WithDecryption=True
             )
+            init_profile.setdefault("ssm get_parameter", time.perf_counter() - started)
             # Support multiple keys separated by commas
             api_keys = [k.strip() for k in response['Parameter']['Value'].split(',') if k.strip()]
-            
-            for key in api_keys:
-                _genai_clients.append(genai.Client(api_key=key))
-                
-            if not _genai_clients:
+            if not api_keys:
                 raise Exception("No Gemini API keys found in SSM parameter.")
-            print(f"Successfully loaded {len(_genai_clients)} API keys.")
         except Exception as e:
             print(f"Error fetching API keys: {e}")
+            if _genai_clients:
+                # Keep the warm clients rather than failing the invocation
+                return _genai_clients
             raise
+
+        fingerprint = hashlib.sha256(",".join(api_keys).encode("utf-8")).hexdigest()
+        if fingerprint != _genai_keys_fingerprint:
+            started = time.perf_counter()
+            _genai_clients = [genai.Client(api_key=key) for key in api_keys]
+            _genai_keys_fingerprint = fingerprint
+            init_profile.setdefault("genai clients", time.perf_counter() - started)
+            print(f"Successfully loaded {len(_genai_clients)} API keys.")
+        _genai_keys_loaded_at = time.time()
             
     return _genai_clients
 
-def get_current_client():
-    clients = get_genai_clients()
-    return clients[_current_client_index]
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at `rate` per second.
+    """
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self._refill()
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self):
+        self._refill()
+        self.tokens = 0
+
+class HealthTracker:
+    """
+    Remembers when each (API key, model) pair last failed and when it may be used again.
+    Times are wall-clock so the state survives being written to S3 and read elsewhere.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pairs = {}  # "key_index|model" -> {"cooldown_until", "failures", "last_error"}
+        self.stats = {"ok": 0, "rate_limited": 0, "server_errors": 0}
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def _pair(self, key_index, model_id):
+        return self._pairs.setdefault(f"{key_index}|{model_id}", {"cooldown_until": 0, "failures": 0, "last_error": None})
+
+    def cooldown_remaining(self, key_index, model_id):
+        with self._lock:
+            return max(0.0, self._pair(key_index, model_id)["cooldown_until"] - time.time())
+
+    def record_success(self, key_index, model_id):
+        with self._lock:
+            pair = self._pair(key_index, model_id)
+            pair["failures"] = 0
+            self.stats["ok"] += 1
+
+    def record_failure(self, key_index, model_id, error, rate_limited):
+        """
+        Puts the pair on cooldown. The server's retry delay wins when the error carries one;
+        once the pair has failed CIRCUIT_BREAKER_THRESHOLD times in a row the circuit opens.
+        """
+        match = RETRY_DELAY_PATTERN.search(str(error))
+        if match:
+            cooldown = float(match.group(1))
+        else:
+            cooldown = RATE_LIMIT_COOLDOWN_SECONDS if rate_limited else SERVER_ERROR_COOLDOWN_SECONDS
+        with self._lock:
+            pair = self._pair(key_index, model_id)
+            pair["failures"] += 1
+            pair["last_error"] = str(error)[:200]
+            self.stats["rate_limited" if rate_limited else "server_errors"] += 1
+            if pair["failures"] >= CIRCUIT_BREAKER_THRESHOLD:
+                cooldown = max(cooldown, CIRCUIT_OPEN_SECONDS)
+                print(f"🚫 Circuit open for {model_id} (Key Index: {key_index}) for {cooldown:.0f}s")
+            pair["cooldown_until"] = max(pair["cooldown_until"], time.time() + cooldown)
+
+    def begin_invocation(self):
+        # The shared state is merged again by the next invocation that calls Gemini; the
+        # call counts start over so report() covers this invocation only
+        with self._load_lock:
+            self._loaded = False
+        with self._lock:
+            self.stats = {"ok": 0, "rate_limited": 0, "server_errors": 0}
+
+    def ensure_loaded(self):
+        with self._load_lock:
+            if not self._loaded:
+                self.load()
+                self._loaded = True
+
+    def load(self):
+        # Merge the shared state: the later cooldown and the higher failure count win
+        if not S3_BUCKET:
+            return
+        try:
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=HEALTH_STATE_KEY)
+            shared = json.loads(response['Body'].read())
+        except botocore_exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                print(f"Failed to load key health state: {e}")
+            return
+        with self._lock:
+            for name, state in shared.items():
+                pair = self._pairs.setdefault(name, {"cooldown_until": 0, "failures": 0, "last_error": None})
+                if state.get("cooldown_until", 0) > pair["cooldown_until"]:
+                    pair.update(state)
+                pair["failures"] = max(pair["failures"], state.get("failures", 0))
+
+    def save(self):
+        # Invocations that never called Gemini have nothing new to share
+        if not S3_BUCKET or not self._loaded:
+            return
+        with self._lock:
+            body = json.dumps(self._pairs, indent=2)
+        try:
+            s3_client.put_object(Bucket=S3_BUCKET, Key=HEALTH_STATE_KEY, Body=body, ContentType='application/json')
+        except Exception as e:
+            print(f"Failed to save key health state: {e}")
 
-def rotate_client():
-    global _current_client_index
+    def report(self):
+        cooling = [name for name in self._pairs if self._pairs[name]["cooldown_until"] > time.time()]
+        print(f"🩺 Gemini calls: {self.stats}, pairs cooling down: {cooling}")
+
+health = HealthTracker()
+
+class RequestScheduler:
+    """
+    Hands out (API key, model) slots. Each pair has an RPM bucket and a TPM bucket;
+    acquire() picks the key that can send soonest and blocks until it may. Pairs on
+    cooldown in the health tracker count as busy until the cooldown ends.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _pair_buckets(self, key_index, model_id):
+        pair = (key_index, model_id)
+        if pair not in self._buckets:
+            limits = MODEL_LIMITS.get(model_id, DEFAULT_MODEL_LIMITS)
+            rpm, tpm = limits["rpm"] / PARSER_WORKERS, limits["tpm"] / PARSER_WORKERS
+            self._buckets[pair] = (TokenBucket(rpm, rpm / 60.0), TokenBucket(tpm, tpm / 60.0))
+        return self._buckets[pair]
+
+    def acquire(self, model_id, key_count, tokens=ESTIMATED_TOKENS_PER_PAGE, exclude=()):
+        """
+        Returns the key index to use for model_id, or None if no key outside `exclude`
+        frees up within MAX_LIMITER_WAIT_SECONDS.
+        """
+        deadline = time.monotonic() + MAX_LIMITER_WAIT_SECONDS
+        while True:
+            with self._lock:
+                best_index, best_wait = None, None
+                for key_index in range(key_count):
+                    if key_index in exclude:
+                        continue
+                    rpm, tpm = self._pair_buckets(key_index, model_id)
+                    wait = max(rpm.wait_time(1), tpm.wait_time(tokens), health.cooldown_remaining(key_index, model_id))
+                    if best_wait is None or wait < best_wait:
+                        best_index, best_wait = key_index, wait
+                if best_index is None:
+                    return None
+                if best_wait == 0:
+                    rpm, tpm = self._pair_buckets(best_index, model_id)
+                    rpm.take(1)
+                    tpm.take(tokens)
+                    return best_index
+            if time.monotonic() + best_wait > deadline:
+                return None
+            time.sleep(min(best_wait, 1.0))
+
+    def exhaust(self, key_index, model_id):
+        # The server said 429: stop handing out this pair until its buckets refill
+        with self._lock:
+            for bucket in self._pair_buckets(key_index, model_id):
+                bucket.drain()
+
+scheduler = RequestScheduler()
+
+def is_rate_limit_error(error):
+    error_msg = str(error).lower()
+    return "429" in error_msg or "resource_exhausted" in error_msg
+
+def is_server_error(error):
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code >= 500
+    error_msg = str(error).lower()
+    return any(marker in error_msg for marker in ("500", "502", "503", "504", "unavailable", "internal"))
+
+class NoCapacityError(Exception):
+    pass
+
+def generate_with_scheduler(model_id, contents, config, tokens=ESTIMATED_TOKENS_PER_PAGE):
+    """
+    Sends one generate_content call through the scheduler. Rate-limited keys are
+    drained and the call moves to the next key; raises NoCapacityError once every
+    key for this model is exhausted, and re-raises any other error.
+    """
+    health.ensure_loaded()
     clients = get_genai_clients()
-    _current_client_index = (_current_client_index + 1) % len(clients)
-    print(f"🔄 Rotating to Gemini API key index: {_current_client_index}")
-    return clients[_current_client_index]
+    tried = set()
+    while len(tried) < len(clients):
+        key_index = scheduler.acquire(model_id, len(clients), tokens=tokens, exclude=tried)
+        if key_index is None:
+            break
+        tried.add(key_index)
+        try:
+            print(f"🔍 Processing with model: {model_id} (Key Index: {key_index})")
+            response = generate_with_prompt_cache(clients[key_index], key_index, model_id, contents, config)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                print(f"Rate limit hit for {model_id} (Key Index: {key_index}), trying next key...")
+                health.record_failure(key_index, model_id, e, rate_limited=True)
+                scheduler.exhaust(key_index, model_id)
+                continue
+            if is_server_error(e):
+                health.record_failure(key_index, model_id, e, rate_limited=False)
+            raise
+        health.record_success(key_index, model_id)
+        prompt_cache.record_usage(response)
+        return response
+    raise NoCapacityError(f"No API key has capacity for {model_id}")
 
 SYSTEM_INSTRUCTION = """
 You are a specialized grocery data extractor for the South African market.
@@ -80,161 +567,1485 @@ Include:
 Note: If a deal says 'All 3 for R75', extract each item separately and link them with a shared 'group_id'.
 """
 
+PROMPT_HASH = hashlib.sha256(SYSTEM_INSTRUCTION.encode("utf-8")).hexdigest()[:16]
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens, cached_tokens):
+        self.text = text
+        self.parsed = None
+        self.usage_metadata = FakeUsage(prompt_tokens, cached_tokens)
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, cached_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = cached_tokens
+
+class FakeGenaiClient:
+    """
+    Offline stand-in for genai.Client covering the calls the parser makes: caches
+    create/update/delete and generate_content (answers an empty product list).
+    """
+    def __init__(self):
+        self.caches = self
+        self.models = self
+        self._caches = {}
+
+    def create(self, model, config):
+        name = f"cachedContents/fake-{len(self._caches)}"
+        self._caches[name] = len(config.system_instruction) // 4
+        return FakeCachedContent(name)
+
+    def update(self, name, config):
+        if name not in self._caches:
+            raise Exception(f"404 NOT_FOUND: {name}")
+        return FakeCachedContent(name)
+
+    def delete(self, name):
+        self._caches.pop(name, None)
+
+    def generate_content(self, model, contents, config):
+        cached_tokens = self._caches.get(config.cached_content, 0) if config.cached_content else 0
+        inline_tokens = len(config.system_instruction or "") // 4
+        return FakeResponse("[]", 258 * len(contents) + inline_tokens + cached_tokens, cached_tokens)
+
+class FakeCachedContent:
+    def __init__(self, name):
+        self.name = name
+
+class PromptCache:
+    """
+    One cached-content handle for SYSTEM_INSTRUCTION per (API key, model). Handles are
+    extended before they expire; pairs where caching fails are sent inline for a while.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}  # (key_index, model) -> (name, expires_at)
+        self._unavailable = {}  # (key_index, model) -> retry_at
+        self._pair_locks = {}  # (key_index, model) -> lock held during its cache call
+        self.tokens = {"calls": 0, "prompt": 0, "cached": 0}
+
+    def reset_stats(self):
+        with self._lock:
+            self.tokens = {"calls": 0, "prompt": 0, "cached": 0}
+
+    def handle(self, client, key_index, model_id):
+        pair = (key_index, model_id)
+        if not USE_CONTEXT_CACHE or len(SYSTEM_INSTRUCTION) // 4 < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        name = self._live_handle(pair)
+        if name is not False:
+            return name
+        # Only threads on this (key, model) wait for its cache call, never the others
+        with self._lock:
+            pair_lock = self._pair_locks.setdefault(pair, threading.Lock())
+        with pair_lock:
+            name = self._live_handle(pair)  # another thread may have refreshed it meanwhile
+            if name is not False:
+                return name
+            with self._lock:
+                name, expires_at = self._handles.get(pair, (None, 0))
+            now = time.time()
+            try:
+                config_ttl = f"{CONTEXT_CACHE_TTL_SECONDS}s"
+                if name and expires_at > now:
+                    client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=config_ttl))
+                else:
+                    name = client.caches.create(
+                        model=model_id,
+                        config=types.CreateCachedContentConfig(system_instruction=SYSTEM_INSTRUCTION, ttl=config_ttl)
+                    ).name
+                    print(f"🧊 Cached system prompt for {model_id} (Key Index: {key_index}): {name}")
+            except Exception as e:
+                print(f"Context caching unavailable for {model_id} (Key Index: {key_index}), sending inline: {e}")
+                with self._lock:
+                    self._handles.pop(pair, None)
+                    self._unavailable[pair] = now + CONTEXT_CACHE_RETRY_SECONDS
+                return None
+            with self._lock:
+                self._handles[pair] = (name, now + CONTEXT_CACHE_TTL_SECONDS)
+            return name
+
+    def _live_handle(self, pair):
+        # The usable handle name, None while caching is unavailable, or False when the
+        # handle must be created or extended
+        now = time.time()
+        with self._lock:
+            if self._unavailable.get(pair, 0) > now:
+                return None
+            name, expires_at = self._handles.get(pair, (None, 0))
+            if name and expires_at - now > CONTEXT_CACHE_REFRESH_SECONDS:
+                return name
+        return False
+
+    def invalidate(self, key_index, model_id):
+        with self._lock:
+            self._handles.pop((key_index, model_id), None)
+
+    def record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            self.tokens["calls"] += 1
+            self.tokens["prompt"] += getattr(usage, "prompt_token_count", None) or 0
+            self.tokens["cached"] += getattr(usage, "cached_content_token_count", None) or 0
+
+    def report(self):
+        if self.tokens["calls"]:
+            prompt, cached = self.tokens["prompt"], self.tokens["cached"]
+            print(f"🧊 Prompt tokens: {prompt} over {self.tokens['calls']} calls, {cached} from cache, "
+                  f"{prompt - cached} uncached ({cached / prompt if prompt else 0:.0%} cached)")
+
+prompt_cache = PromptCache()
+
+def generate_with_prompt_cache(client, key_index, model_id, contents, config):
+    """
+    Calls generate_content with the cached system prompt when there is a handle for
+    this pair. If the cached call fails for anything but quota, the handle is dropped
+    and the call is retried once with the prompt inline.
+    """
+    cache_name = prompt_cache.handle(client, key_index, model_id)
+    if cache_name is None or config.system_instruction != SYSTEM_INSTRUCTION:
+        return client.models.generate_content(model=model_id, contents=contents, config=config)
+    try:
+        cached_config = config.model_copy(update={"system_instruction": None, "cached_content": cache_name})
+        return client.models.generate_content(model=model_id, contents=contents, config=cached_config)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            raise
+        print(f"Cached prompt call failed for {model_id} (Key Index: {key_index}), retrying inline: {e}")
+        prompt_cache.invalidate(key_index, model_id)
+        return client.models.generate_content(model=model_id, contents=contents, config=config)
+
+_parse_cache = OrderedDict()  # S3 cache key -> parsed data, LRU within a warm container
+_parse_cache_lock = threading.Lock()
+parse_cache_stats = {"hits": 0, "misses": 0}
+
+def parse_cache_prefix(image_hash):
+    return f"{PARSE_CACHE_PREFIX}{image_hash}/{PROMPT_HASH}/"
+
+def remember_parse(cache_key, data):
+    with _parse_cache_lock:
+        _parse_cache[cache_key] = data
+        _parse_cache.move_to_end(cache_key)
+        while len(_parse_cache) > PARSE_CACHE_MEMORY_ENTRIES:
+            _parse_cache.popitem(last=False)
+
+def lookup_parse_cache(image_hash, models):
+    """
+    Returns (model_id, data) for the first model in `models` with a live cache entry,
+    or (None, None). One LIST covers every model for the page. Expired entries are left
+    to the bucket lifecycle rule.
+    """
+    if not USE_PARSE_CACHE:
+        return None, None
+    prefix = parse_cache_prefix(image_hash)
+    with _parse_cache_lock:
+        for model_id in models:
+            cache_key = f"{prefix}{model_id}.json"
+            if cache_key in _parse_cache:
+                _parse_cache.move_to_end(cache_key)
+                parse_cache_stats["hits"] += 1
+                return model_id, _parse_cache[cache_key]
+
+    live = set()
+    expires_before = datetime.now(timezone.utc) - timedelta(days=PARSE_CACHE_TTL_DAYS)
+    try:
+        response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=prefix)
+        for obj in response.get('Contents', []):
+            if obj['LastModified'] >= expires_before:
+                live.add(obj['Key'])
+        for model_id in models:
+            cache_key = f"{prefix}{model_id}.json"
+            if cache_key in live:
+                data = json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=cache_key)['Body'].read())
+                remember_parse(cache_key, data)
+                with _parse_cache_lock:
+                    parse_cache_stats["hits"] += 1
+                return model_id, data
+    except Exception as e:
+        print(f"Parse cache lookup failed for {image_hash}: {e}")
+
+    with _parse_cache_lock:
+        parse_cache_stats["misses"] += 1
+    return None, None
+
+def store_parse_cache(image_hash, model_id, data):
+    if not USE_PARSE_CACHE:
+        return
+    cache_key = f"{parse_cache_prefix(image_hash)}{model_id}.json"
+    remember_parse(cache_key, data)
+    try:
+        s3_client.put_object(Bucket=S3_BUCKET, Key=cache_key, Body=json.dumps(data), ContentType='application/json')
+    except Exception as e:
+        print(f"Failed to store parse cache entry {cache_key}: {e}")
+
+def claim_parse(image_hash, s3_key, retake=True):
+    """
+    Returns True if this worker should call Gemini for the page. Only one worker can
+    create the claim object; an expired claim is deleted and claimed again once.
+    """
+    if not (USE_PARSE_CACHE and S3_BUCKET):
+        return True
+    claim_key = f"{parse_cache_prefix(image_hash)}parsing.json"
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=claim_key,
+            Body=json.dumps({"s3_key": s3_key, "claimed_at": time.time()}),
+            ContentType='application/json',
+            IfNoneMatch='*'
+        )
+        return True
+    except botocore_exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+            raise
+    try:
+        claim = json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=claim_key)['Body'].read())
+    except botocore_exceptions.ClientError:
+        claim = {}
+    if retake and time.time() - claim.get("claimed_at", 0) > PARSE_CLAIM_TTL_SECONDS:
+        print(f"Parse claim on {image_hash} by {claim.get('s3_key')} expired, taking over")
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=claim_key)
+        return claim_parse(image_hash, s3_key, retake=False)
+    print(f"⏳ {claim.get('s3_key')} is already parsing the same page as {s3_key}, waiting for the cache")
+    return False
+
+def release_parse_claim(image_hash):
+    # The cache entry (or a failure) is final; waiting workers look the cache up again
+    try:
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{parse_cache_prefix(image_hash)}parsing.json")
+    except Exception as e:
+        print(f"Failed to release parse claim on {image_hash}: {e}")
+
+def report_parse_cache():
+    lookups = parse_cache_stats["hits"] + parse_cache_stats["misses"]
+    if lookups:
+        print(f"♻️ Parse cache: {parse_cache_stats['hits']}/{lookups} hits ({parse_cache_stats['hits'] / lookups:.0%})")
+
+image_prep_stats = {"pages": 0, "resized": 0, "prep_cpu_s": 0.0, "saved_cpu_s": 0.0}
+_image_prep_lock = threading.Lock()
+
+def round_trip_cpu_seconds(image_bytes):
+    # What the SDK path used to cost: decode the page with PIL, then encode it again
+    started = time.thread_time()
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.load()
+        img.save(io.BytesIO(), format=img.format or "JPEG")
+    return time.thread_time() - started
+
+def build_image_part(image_bytes, mime_type, metadata):
+    """
+    Wraps the page bytes as an inline Gemini part. The image is only decoded when the
+    converter's width/height metadata (or its absence) says it may need a resize.
+    """
+    # Resolve the lazy google.genai import first so its one-off cost isn't counted as prep
+    Part = types.Part
+    started = time.thread_time()
+    resized = False
+    long_edge = max(int(metadata.get('width', 0) or 0), int(metadata.get('height', 0) or 0))
+    if MAX_IMAGE_LONG_EDGE and (long_edge == 0 or long_edge > MAX_IMAGE_LONG_EDGE):
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            if max(img.size) > MAX_IMAGE_LONG_EDGE:
+                img.thumbnail((MAX_IMAGE_LONG_EDGE, MAX_IMAGE_LONG_EDGE), Image.LANCZOS)
+                buffer = io.BytesIO()
+                img.convert("RGB").save(buffer, format="JPEG", quality=90)
+                image_bytes, mime_type, resized = buffer.getvalue(), "image/jpeg", True
+    part = Part.from_bytes(data=image_bytes, mime_type=mime_type)
+    prep_cpu_s = time.thread_time() - started
+
+    saved_cpu_s = round_trip_cpu_seconds(image_bytes) - prep_cpu_s if MEASURE_DECODE_SAVINGS and not resized else None
+    with _image_prep_lock:
+        image_prep_stats["pages"] += 1
+        image_prep_stats["resized"] += int(resized)
+        image_prep_stats["prep_cpu_s"] += prep_cpu_s
+        image_prep_stats["saved_cpu_s"] += saved_cpu_s or 0.0
+    saved_note = f", saved {saved_cpu_s * 1000:.0f} ms CPU vs PIL round trip" if saved_cpu_s is not None else ""
+    print(f"🖼️ Image part ready: {len(image_bytes) / 1e6:.2f} MB {mime_type}{' (resized)' if resized else ''}, "
+          f"{prep_cpu_s * 1000:.1f} ms CPU{saved_note}")
+    return part
+
+def report_image_prep():
+    if image_prep_stats["pages"]:
+        pages = image_prep_stats["pages"]
+        saved = f", {image_prep_stats['saved_cpu_s'] / pages * 1000:.0f} ms CPU saved/page" if MEASURE_DECODE_SAVINGS else ""
+        print(f"🖼️ Image prep: {pages} pages, {image_prep_stats['resized']} resized, "
+              f"{image_prep_stats['prep_cpu_s'] / pages * 1000:.1f} ms CPU/page{saved}")
+
 def upload_to_s3(data, s3_key):
     if not S3_BUCKET:
         print(f"S3_BUCKET_NAME not set, skipping upload")
         return
     try:
         s3_client.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=json.dumps(data, indent=4))
+        mark_exists(s3_key)
         print(f"Successfully uploaded JSON to s3://{S3_BUCKET}/{s3_key}")
     except Exception as e:
         print(f"Failed to upload to S3: {e}")
 
-def process_image(s3_key):
+def output_key_for(s3_key):
     # s3_key example: data/interim/images/PnP/Gauteng/Weekly_Specials/page_1.jpg
     filename = os.path.basename(s3_key)
     
     # Extract relative path to reconstruct output structure
     try:
-        relative_path = s3_key.split('data/interim/images/PnP/')[1]
-        output_key = f"{OUTPUT_PREFIX}{os.path.splitext(relative_path)[0]}.json"
+        relative_path = s3_key.split(IMAGE_PREFIX)[1]
+        return f"{OUTPUT_PREFIX}{os.path.splitext(relative_path)[0]}.json"
     except IndexError:
-        output_key = f"{OUTPUT_PREFIX}{os.path.splitext(filename)[0]}.json"
+        return f"{OUTPUT_PREFIX}{os.path.splitext(filename)[0]}.json"
+
+def load_page(s3_key, claim=False):
+    """
+    Everything before the Gemini call: skip checks, download, page-type handling and
+    the parse cache. Returns (status, None) when the page is settled or, with `claim`,
+    ("waiting", None) while another worker parses the same image; otherwise (None, page).
+    A page returned under a claim must be passed to release_parse_claim afterwards.
+    """
+    output_key = output_key_for(s3_key)
 
     if file_exists_in_s3(S3_BUCKET, output_key):
         print(f"⏩ Skipping (already exists in S3): {output_key}")
-        return "skipped"
+        return "skipped", None
 
     print(f"Downloading image from S3: {s3_key}")
     try:
         response = s3_client.get_object(Bucket=S3_BUCKET, Key=s3_key)
+        metadata = response.get('Metadata', {})
+        page_type = metadata.get('page-type', 'unknown')
+        if page_type in SKIP_PAGE_TYPES:
+            print(f"⏩ Skipping {page_type} page (no products expected): {s3_key}")
+            response['Body'].close()
+            upload_to_s3([], output_key)
+            return "skipped", None
         image_bytes = response['Body'].read()
-        img = Image.open(io.BytesIO(image_bytes))
     except Exception as e:
         print(f"Error reading image from S3: {e}")
-        return "error"
-
-    # Try models
-    for model_id in MODELS:
-        clients = get_genai_clients()
-        # Try each client for the current model if rate limited
-        for _ in range(len(clients)):
-            client = get_current_client()
-            try:
-                print(f"🔍 Processing with model: {model_id} (Key Index: {_current_client_index})")
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=[img, "Extract grocery data according to system instructions."],
-                    config=types.GenerateContentConfig(
-                        system_instruction=SYSTEM_INSTRUCTION,
-                        response_mime_type="application/json"
-                    )
+        return "error", None
+
+    models = MODELS[:1] if page_type in DOWN_TIER_PAGE_TYPES else MODELS
+    if page_type in DOWN_TIER_PAGE_TYPES:
+        print(f"⬇️ Down-tiering {page_type} page to {models[0]}")
+
+    tile = should_tile(page_type)
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    cached_model, cached_data = lookup_parse_cache(image_hash, [TILED_CACHE_MODEL] + models if tile else models)
+    if cached_data is not None:
+        upload_to_s3(cached_data, output_key)
+        print(f"♻️ Parse cache hit ({cached_model}) for {s3_key}")
+        return "cached", None
+    if claim and not claim_parse(image_hash, s3_key):
+        return "waiting", None
+
+    mime_type = IMAGE_MIME_TYPES.get(os.path.splitext(s3_key)[1].lower(), "image/jpeg")
+    try:
+        image_part = build_image_part(image_bytes, mime_type, metadata)
+    except Exception as e:
+        print(f"Error preparing image {s3_key}: {e}")
+        if claim:
+            release_parse_claim(image_hash)
+        return "error", None
+
+    return None, {
+        "s3_key": s3_key,
+        "output_key": output_key,
+        "page_type": page_type,
+        "models": models,
+        "image_hash": image_hash,
+        "image_part": image_part,
+        "size_bytes": len(image_bytes),
+        "image_bytes": image_bytes if tile else None,
+        "tile": tile,
+        "claimed": claim,
+    }
+
+def response_data(response):
+    data = response.parsed if hasattr(response, 'parsed') and response.parsed is not None else None
+    
+    if data is None and hasattr(response, 'text') and response.text:
+        try:
+            data = json.loads(response.text)
+        except json.JSONDecodeError:
+            pass
+    return data
+
+cascade_stats = {}  # model -> {"attempts", "accepted", "escalated", "seconds"}, this invocation
+# Escalation rates for the time-budget predictor, kept for the life of the warm container
+escalation_history = {}  # model -> {"attempts", "escalated"}
+_cascade_lock = threading.Lock()
+
+def record_cascade(model_id, outcome, seconds):
+    with _cascade_lock:
+        stats = cascade_stats.setdefault(model_id, {"attempts": 0, "accepted": 0, "escalated": 0, "seconds": 0.0})
+        stats["attempts"] += 1
+        stats[outcome] += 1
+        stats["seconds"] += seconds
+        history = escalation_history.setdefault(model_id, {"attempts": 0, "escalated": 0})
+        history["attempts"] += 1
+        history["escalated"] += int(outcome == "escalated")
+
+def report_cascade():
+    for model_id, stats in cascade_stats.items():
+        print(f"🪜 {model_id}: {stats['attempts']} calls, {stats['escalated'] / stats['attempts']:.0%} escalated, "
+              f"{stats['seconds'] / stats['attempts']:.1f}s avg")
+
+_image_sizes = {}  # image key -> bytes, from the listing or the queue message
+
+def size_bucket(size_bytes):
+    if not size_bytes:
+        return "unknown"
+    return "small" if size_bytes < 1e6 else "medium" if size_bytes < 3e6 else "large"
+
+class LatencyTracker:
+    """
+    Rolling Gemini call latencies per (model, image size bucket), kept for the life of
+    the warm container.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, model_id, size_bytes, seconds):
+        with self._lock:
+            self._samples.setdefault((model_id, size_bucket(size_bytes)), deque(maxlen=PAGE_LATENCY_WINDOW)).append(seconds)
+
+    def p90(self, model_id, size_bytes):
+        with self._lock:
+            samples = self._samples.get((model_id, size_bucket(size_bytes)))
+            if not samples:
+                # Fall back to the model's other size buckets before the default
+                samples = [v for (m, _), window in self._samples.items() if m == model_id for v in window]
+            if not samples:
+                return DEFAULT_CALL_SECONDS
+            ordered = sorted(samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))]
+
+    def predict_page(self, size_bytes, models=MODELS):
+        # Expected cascade time: each model's p90, weighted by the chance the page reaches it
+        predicted, reach = 0.0, 1.0
+        for model_id in models:
+            predicted += reach * self.p90(model_id, size_bytes)
+            stats = escalation_history.get(model_id)
+            reach *= stats["escalated"] / stats["attempts"] if stats else 0.0
+            if reach < 0.01:
+                break
+        return predicted
+
+latency = LatencyTracker()
+
+class InvocationBudget:
+    """
+    Decides whether another page fits in this invocation and reports how much of the
+    Lambda timeout was put to use. `timeout_seconds` is what a fresh invocation gets,
+    taken once when the handler starts.
+    """
+    def __init__(self, context, timeout_seconds=None):
+        self.context = context
+        self.started = time.monotonic()
+        self.budget = context.get_remaining_time_in_millis() / 1000
+        self.timeout = timeout_seconds or self.budget
+        self._lock = threading.Lock()
+        self.page_seconds = 0.0
+        self.pages = 0
+        self.deferred = 0
+
+    def remaining(self):
+        return self.context.get_remaining_time_in_millis() / 1000
+
+    def can_start(self, predicted):
+        # Work that would not fit a fresh invocation either is started anyway, deferring
+        # it would only hand it from one invocation to the next
+        if predicted > self.timeout - TIME_BUDGET_MARGIN_SECONDS:
+            return True
+        return self.remaining() - predicted > TIME_BUDGET_MARGIN_SECONDS
+
+    def record(self, pages, seconds):
+        with self._lock:
+            self.pages += pages
+            self.page_seconds += seconds
+
+    def defer(self, pages):
+        with self._lock:
+            self.deferred += pages
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        slots = elapsed * PARSER_CONCURRENCY
+        print(f"⏱️ Used {elapsed:.0f}s of {self.budget:.0f}s ({elapsed / self.budget:.0%}), "
+              f"{self.pages} pages, {self.deferred} deferred, worker slots {self.page_seconds / slots if slots else 0:.0%} busy, "
+              f"{self.remaining():.0f}s left unused")
+
+def parse_price(value):
+    try:
+        return float(str(value).replace("R", "").replace(",", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+def valid_box(box):
+    return (isinstance(box, list) and len(box) == 4 and all(isinstance(v, (int, float)) for v in box)
+            and 0 <= box[0] < box[2] <= 1000 and 0 <= box[1] < box[3] <= 1000)
+
+def score_products(data, page_type=None, area_share=1.0):
+    """
+    0-1 confidence in an extraction: share of schema-valid products, share of parseable
+    prices, whether the product boxes cover a plausible part of the page, and whether
+    that area holds as many products as the page type usually does. `area_share` is the
+    part of the page the image shows (a tile).
+    """
+    if not isinstance(data, list) or not data:
+        return 0.0
+    products = [p for p in data if isinstance(p, dict)]
+    valid = [p for p in products if isinstance(p.get("product_name"), str) and p["product_name"].strip()
+             and valid_box(p.get("bounding_box"))]
+    priced = [p for p in products if parse_price(p.get("current_price")) is not None]
+    coverage = sum((p["bounding_box"][2] - p["bounding_box"][0]) * (p["bounding_box"][3] - p["bounding_box"][1])
+                   for p in valid) / 1e6
+    coverage_score = min(1.0, coverage / CASCADE_MIN_COVERAGE) if CASCADE_MIN_COVERAGE else 1.0
+    expected = min(PRODUCT_DENSITY.get(page_type, PRODUCT_DENSITY["unknown"]) * coverage * area_share,
+                   PRODUCT_DENSITY_CAP)
+    density_score = min(1.0, len(valid) / expected) if expected > 0 else 1.0
+    return (len(valid) / len(data)) * (len(priced) / len(data)) * coverage_score * density_score
+
+def accept_products(page, model_id, data):
+    upload_to_s3(data, page["output_key"])
+    store_parse_cache(page["image_hash"], model_id, data)
+
+def run_cascade(image_part, size_bytes, models, label, best=None, page_type=None, area_share=1.0,
+                empty_escalations=None):
+    """
+    Walks a model cascade, cheapest first, and stops at the first answer that scores at
+    least CASCADE_MIN_SCORE. `best` is an earlier (score, model, data) to beat; the page
+    type and area share feed score_products. Returns
+    the accepted (score, model, data), or None when no model produced anything. A valid
+    empty answer ([]) still escalates, but settles the page if nothing better turns up;
+    `empty_escalations` caps how many more models an empty answer is escalated to.
+    """
+    empty = None
+    empties = 0
+    for model_id in models:
+        started = time.monotonic()
+        try:
+            response = generate_with_scheduler(
+                model_id,
+                contents=[image_part, "Extract grocery data according to system instructions."],
+                config=types.GenerateContentConfig(
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    response_mime_type="application/json"
                 )
+            )
+        except Exception as e:
+            print(f"❌ Error with {model_id}: {e}")
+            continue # Move to next model
 
-                data = response.parsed if hasattr(response, 'parsed') and response.parsed is not None else None
-                
-                if data is None and hasattr(response, 'text') and response.text:
-                    try:
-                        data = json.loads(response.text)
-                    except json.JSONDecodeError:
-                        pass
-
-                if data:
-                    upload_to_s3(data, output_key)
-                    print(f"✅ Success with {model_id}")
-                    return "processed"
-                else:
-                    print(f"⚠️ No data extracted with {model_id}")
-                    break # Move to next model if no data but no error
+        latency.record(model_id, size_bytes, time.monotonic() - started)
+        data = response_data(response)
+        score = score_products(data, page_type, area_share)
+        is_last = model_id == models[-1]
+        if data and (score >= CASCADE_MIN_SCORE or (is_last and best is None)):
+            record_cascade(model_id, "accepted", time.monotonic() - started)
+            print(f"✅ Success with {model_id} (score {score:.2f})")
+            return score, model_id, data
 
-            except Exception as e:
-                error_msg = str(e).lower()
-                print(f"❌ Error with {model_id} (Key Index: {_current_client_index}): {e}")
-                if "429" in error_msg or "resource_exhausted" in error_msg:
-                    if len(clients) > 1:
-                        print(f"Rate limit hit, rotating client...")
-                        rotate_client()
-                        continue # Retry same model with next client
-                    else:
-                        print(f"Rate limit hit and only one key available.")
-                        break # Move to next model
-                break # Non-rate-limit error, move to next model
-
-    print(f"❌ All models and keys failed for {s3_key}")
+        if data == []:
+            empty = empty or (0.0, model_id, [])
+            empties += 1
+            if best is None and empty_escalations is not None and empties > empty_escalations:
+                record_cascade(model_id, "accepted", time.monotonic() - started)
+                print(f"🫙 {model_id} found no products on {label}, settling it as empty")
+                return empty
+        record_cascade(model_id, "escalated", time.monotonic() - started)
+        if data:
+            print(f"🪜 {model_id} scored {score:.2f} on {label}, escalating")
+            if best is None or score > best[0]:
+                best = (score, model_id, data)
+        elif data == []:
+            print(f"🫙 {model_id} found no products on {label}, escalating")
+        else:
+            print(f"⚠️ No data extracted with {model_id}")
+
+    if best:
+        print(f"✅ Keeping best answer from {best[1]} (score {best[0]:.2f}) for {label}")
+    elif empty:
+        print(f"🫙 No model found products on {label}, settling it as empty")
+    return best or empty
+
+def parse_page(page, models=None, best=None):
+    if page.get("tile") and best is None:
+        return parse_tiled(page)
+    models = page["models"] if models is None else models
+    result = run_cascade(page["image_part"], page["size_bytes"], models, page["s3_key"], best, page["page_type"])
+    if result:
+        accept_products(page, result[1], result[2])
+        return "processed" if result[2] else "empty"
+
+    print(f"❌ All models and keys failed for {page['s3_key']}")
     return "failed"
 
-def discover_and_process(prefix, token, context):
+def should_tile(page_type):
+    return TILE_MODE == "all" or (TILE_MODE == "dense" and page_type == "product_grid")
+
+def tile_boxes(width, height):
+    # Pixel boxes (left, top, right, bottom) of the grid, each grown by TILE_OVERLAP
+    columns, rows = TILE_GRID
+    tile_w, tile_h = width / columns, height / rows
+    pad_x, pad_y = tile_w * TILE_OVERLAP, tile_h * TILE_OVERLAP
+    return [
+        (int(max(0, c * tile_w - pad_x)), int(max(0, r * tile_h - pad_y)),
+         int(min(width, (c + 1) * tile_w + pad_x)), int(min(height, (r + 1) * tile_h + pad_y)))
+        for r in range(rows) for c in range(columns)
+    ]
+
+def clamp_box(box):
+    # A [ymin, xmin, ymax, xmax] that overshoots 0-1000 pulled back inside it, or None
+    if not (isinstance(box, list) and len(box) == 4 and all(isinstance(v, (int, float)) for v in box)):
+        return None
+    ymin, xmin, ymax, xmax = [min(1000, max(0, v)) for v in box]
+    return [ymin, xmin, ymax, xmax] if ymin < ymax and xmin < xmax else None
+
+def to_page_box(box, tile, width, height):
+    # Tile-local [ymin, xmin, ymax, xmax] in 0-1000 to page-level 0-1000
+    left, top, right, bottom = tile
+    ymin, xmin, ymax, xmax = box
+    return [
+        round((top + ymin / 1000 * (bottom - top)) / height * 1000),
+        round((left + xmin / 1000 * (right - left)) / width * 1000),
+        round((top + ymax / 1000 * (bottom - top)) / height * 1000),
+        round((left + xmax / 1000 * (right - left)) / width * 1000),
+    ]
+
+def box_overlap(a, b):
+    # Intersection over the smaller box: a product cut by a seam sits inside its twin
+    inter = max(0, min(a[2], b[2]) - max(a[0], b[0])) * max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+    return inter / smaller if smaller > 0 else 0.0
+
+def product_name_key(product):
+    return " ".join(str(product.get("product_name") or "").lower().split())
+
+def overlap_band(tile_a, tile_b, width, height):
+    # Page-level [ymin, xmin, ymax, xmax] 0-1000 area both tiles show, or None
+    left, top = max(tile_a[0], tile_b[0]), max(tile_a[1], tile_b[1])
+    right, bottom = min(tile_a[2], tile_b[2]), min(tile_a[3], tile_b[3])
+    if right <= left or bottom <= top:
+        return None
+    return [top / height * 1000, left / width * 1000, bottom / height * 1000, right / width * 1000]
+
+def touches(box, band):
+    return min(box[2], band[2]) > max(box[0], band[0]) and min(box[3], band[3]) > max(box[1], band[1])
+
+def merge_tile_products(tile_results, width, height):
     """
-    Lists all images in a prefix and processes them recursively.
+    Maps every tile's products onto the page and merges seam duplicates: a product from
+    another tile with the same name, both boxes reaching into the band the two tiles
+    share and overlapping by TILE_DEDUP_OVERLAP keeps one entry whose box is the union.
+    Products from one tile are never merged with each other, so multi-buy items sharing
+    a price and group_id stay separate; a group seen by two tiles keeps one group_id.
     """
-    print(f"🕵️ Starting discovery in: {prefix}")
-    params = {'Bucket': S3_BUCKET, 'Prefix': prefix}
-    if token:
-        params['ContinuationToken'] = token
+    merged = []  # (tile_index, product)
+    group_alias = {}
+    for tile_index, (tile, products) in enumerate(tile_results):
+        for product in products if isinstance(products, list) else []:
+            if not isinstance(product, dict):
+                continue
+            product = dict(product)
+            # A tile-local box must not reach the page JSON, where the cropper would read
+            # it as page coordinates: map it once it's clamped, or drop it
+            box = clamp_box(product.get("bounding_box"))
+            if box:
+                product["bounding_box"] = to_page_box(box, tile, width, height)
+            else:
+                product.pop("bounding_box", None)
+            if product.get("group_id") is not None:
+                # group ids are only unique within one tile's answer
+                product["group_id"] = f"t{tile_index}_{product['group_id']}"
+            twin = None
+            if valid_box(product.get("bounding_box")) and product_name_key(product):
+                for kept_index, kept in merged:
+                    band = overlap_band(tile_results[kept_index][0], tile, width, height)
+                    if (kept_index != tile_index and band and valid_box(kept.get("bounding_box"))
+                            and product_name_key(kept) == product_name_key(product)
+                            and touches(kept["bounding_box"], band) and touches(product["bounding_box"], band)
+                            and box_overlap(kept["bounding_box"], product["bounding_box"]) >= TILE_DEDUP_OVERLAP):
+                        twin = kept
+                        break
+            if twin is None:
+                merged.append((tile_index, product))
+                continue
+            a, b = twin["bounding_box"], product["bounding_box"]
+            twin["bounding_box"] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+            if twin.get("group_id") is not None and product.get("group_id") is not None:
+                group_alias[product["group_id"]] = twin["group_id"]
 
-    response = s3_client.list_objects_v2(**params)
-    
-    if 'Contents' not in response:
-        print("No more files to process.")
-        return
+    results = [product for _, product in merged]
+    for product in results:
+        if product.get("group_id") in group_alias:
+            product["group_id"] = group_alias[product["group_id"]]
+    return results
 
-    for obj in response['Contents']:
-        # Check remaining time (stop if less than 60 seconds remain)
-        if context.get_remaining_time_in_millis() < 60000:
-            print("⏳ Time running out. Triggering next batch...")
-            new_token = response.get('NextContinuationToken') or response.get('ContinuationToken')
-            if not new_token: # list_objects_v2 might not give NextContinuationToken if it's the last page
-                # If we don't have a token but we have more pages, we might need to handle this.
-                # However, list_objects_v2 with pagination is usually better.
-                pass
-            
-            trigger_self(prefix, response.get('NextContinuationToken'))
-            return
+def parse_tiled(page):
+    """
+    Parses a page as overlapping tiles in parallel and writes the merged products in
+    page coordinates. A page whose tiles all answered [] is settled as empty; it falls
+    back to the whole page if the image can't be tiled or no tile produced an answer.
+    """
+    try:
+        with Image.open(io.BytesIO(page["image_bytes"])) as img:
+            img = img.convert("RGB")
+            width, height = img.size
+            tiles = []
+            for tile in tile_boxes(width, height):
+                buffer = io.BytesIO()
+                img.crop(tile).save(buffer, format="JPEG", quality=90)
+                tiles.append((tile, buffer.getvalue()))
+    except Exception as e:
+        print(f"Could not tile {page['s3_key']}, parsing whole page: {e}")
+        return parse_page(dict(page, tile=False))
 
-        key = obj['Key']
-        if (key.endswith('.jpg') or key.endswith('.png')) and 'data/interim/images/PnP/' in key:
-            print(f"Processing image from discovery: {key}")
-            result = process_image(key)
-            if result == "processed":
-                time.sleep(2) # Small delay to respect quotas
+    def parse_tile(item):
+        tile, tile_bytes = item
+        part = types.Part.from_bytes(data=tile_bytes, mime_type="image/jpeg")
+        area_share = (tile[2] - tile[0]) * (tile[3] - tile[1]) / (width * height)
+        result = run_cascade(part, len(tile_bytes), page["models"], f"{page['s3_key']} tile {tile}",
+                             page_type=page["page_type"], area_share=area_share,
+                             empty_escalations=TILE_EMPTY_ESCALATIONS)
+        return tile, result[2] if result else None
 
-    # If there are more pages, trigger the next one
-    if response.get('IsTruncated'):
-        print("Moving to next page of S3 results...")
-        trigger_self(prefix, response.get('NextContinuationToken'))
+    print(f"🧩 Tiling {page['s3_key']} into {len(tiles)} tiles")
+    with ThreadPoolExecutor(max_workers=len(tiles)) as executor:
+        tile_results = list(executor.map(parse_tile, tiles))
 
-def trigger_self(prefix, token):
+    answered = [(tile, products) for tile, products in tile_results if products]
+    if not answered and all(products == [] for _, products in tile_results):
+        accept_products(page, TILED_CACHE_MODEL, [])
+        print(f"🫙 No tile found products on {page['s3_key']}, settling it as empty")
+        return "empty"
+    if not answered:
+        print(f"No tile produced products for {page['s3_key']}, parsing whole page")
+        return parse_page(dict(page, tile=False))
+
+    products = merge_tile_products(answered, width, height)
+    found = sum(len(p) for _, p in answered if isinstance(p, list))
+    accept_products(page, TILED_CACHE_MODEL, products)
+    print(f"🧩 Merged {found} tile products into {len(products)} for {page['s3_key']} "
+          f"({len(answered)}/{len(tiles)} tiles answered)")
+    return "processed"
+
+def process_image(s3_key):
+    status, page = load_page(s3_key)
+    return status or parse_page(page)
+
+def page_label(s3_key):
+    return os.path.splitext(os.path.basename(s3_key))[0]
+
+def parse_batch(pages):
     """
-    Invokes the current lambda function asynchronously.
+    Sends several pages of one flyer in a single request and asks for an object keyed
+    by page label. Pages missing from a malformed or partial answer are parsed alone.
     """
-    payload = {
-        'discovery_prefix': prefix,
-        'continuation_token': token
-    }
-    print(f"Self-triggering with token: {token}")
-    lambda_client.invoke(
-        FunctionName=os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
-        InvocationType='Event',
-        Payload=json.dumps(payload)
+    labels = [page_label(page["s3_key"]) for page in pages]
+    contents = []
+    for label, page in zip(labels, pages):
+        contents += [f"Page label: {label}", page["image_part"]]
+    contents.append(
+        "Extract grocery data from every page according to system instructions. "
+        f"Return one JSON object whose keys are exactly these page labels: {', '.join(labels)}. "
+        "Each value is that page's JSON array of products (an empty array if it has none)."
+    )
+
+    results = {}
+    model_id = pages[0]["models"][0]
+    try:
+        response = generate_with_scheduler(
+            model_id,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION,
+                response_mime_type="application/json"
+            ),
+            tokens=ESTIMATED_TOKENS_PER_PAGE * len(pages)
+        )
+        data = response_data(response)
+    except Exception as e:
+        print(f"❌ Batch of {len(pages)} pages failed with {model_id}: {e}")
+        data = None
+
+    low_scores = {}
+    if isinstance(data, dict):
+        for label, page in zip(labels, pages):
+            products = data.get(label)
+            score = score_products(products, page["page_type"])
+            if score >= CASCADE_MIN_SCORE:
+                accept_products(page, model_id, products)
+                results[page["s3_key"]] = "processed"
+            elif isinstance(products, list) and products:
+                low_scores[page["s3_key"]] = (score, model_id, products)
+        print(f"📦 Batch with {model_id}: {len(results)}/{len(pages)} pages in one request")
+
+    for page in pages:
+        if page["s3_key"] in low_scores:
+            # The batch already tried the cheapest model, escalate from the next one
+            print(f"🪜 {model_id} scored {low_scores[page['s3_key']][0]:.2f} on {page['s3_key']} in the batch, escalating")
+            results[page["s3_key"]] = parse_page(page, page["models"][1:], low_scores[page["s3_key"]])
+        elif page["s3_key"] not in results:
+            print(f"↩️ Falling back to a single-page request for {page['s3_key']}")
+            results[page["s3_key"]] = parse_page(page)
+    return [results[page["s3_key"]] for page in pages]
+
+def process_image_group(s3_keys, claim=False):
+    """
+    Processes pages of one flyer. With BATCH_PAGES > 1 the pages that still need Gemini
+    (and share a model cascade) go out together; anything else is parsed page by page.
+    With `claim` (queue workers) pages another worker is parsing come back "waiting".
+    """
+    statuses = {}
+    pending = []
+    for s3_key in s3_keys:
+        status, page = load_page(s3_key, claim)
+        if status:
+            statuses[s3_key] = status
+        else:
+            pending.append(page)
+    try:
+        parse_pending(pending, statuses)
+    finally:
+        for page in pending:
+            if page["claimed"]:
+                release_parse_claim(page["image_hash"])
+    return [statuses[s3_key] for s3_key in s3_keys]
+
+def parse_pending(pending, statuses):
+    # Gemini calls for the loaded pages of one group; fills statuses by s3_key
+
+    batchable = [page for page in pending if page["models"] == MODELS and not page["tile"]]
+    singles = [page for page in pending if page["models"] != MODELS or page["tile"]]
+    if len(batchable) < 2:
+        singles += batchable
+        batchable = []
+    if batchable:
+        for page, status in zip(batchable, parse_batch(batchable)):
+            statuses[page["s3_key"]] = status
+    for page in singles:
+        statuses[page["s3_key"]] = parse_page(page)
+
+def group_for_batching(s3_keys):
+    # Chunks of up to BATCH_PAGES pages from the same flyer folder
+    if BATCH_PAGES <= 1:
+        return [[s3_key] for s3_key in s3_keys]
+    by_flyer = OrderedDict()
+    for s3_key in s3_keys:
+        by_flyer.setdefault(os.path.dirname(s3_key), []).append(s3_key)
+    groups = []
+    for flyer_keys in by_flyer.values():
+        for start in range(0, len(flyer_keys), BATCH_PAGES):
+            groups.append(flyer_keys[start:start + BATCH_PAGES])
+    return groups
+
+class SQSWorkQueue:
+    """
+    Durable page queue. Messages are image keys; a message is deleted by the event
+    source mapping once its page is reported done. Sending a key again starts a new
+    message, with its own receive count.
+    """
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def send(self, image_keys, delay_seconds=0):
+        # Returns the keys SQS refused
+        refused = []
+        for start in range(0, len(image_keys), QUEUE_SEND_BATCH):
+            chunk = image_keys[start:start + QUEUE_SEND_BATCH]
+            response = sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{"Id": str(i), "MessageBody": json.dumps({"image_key": key, "size_bytes": _image_sizes.get(key, 0)}),
+                          "DelaySeconds": delay_seconds} for i, key in enumerate(chunk)]
+            )
+            for failure in response.get('Failed', []):
+                print(f"❌ Failed to queue {chunk[int(failure['Id'])]}: {failure.get('Message')}")
+                refused.append(chunk[int(failure['Id'])])
+        return refused
+
+class LocalWorkQueue:
+    """
+    In-process stand-in for the SQS queue with the same send() plus receive/ack/nack,
+    so the planner and workers can be exercised without AWS.
+    """
+    def __init__(self, max_receives=5):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._delayed = []  # (visible_at, key)
+        self._receives = {}
+        self.max_receives = max_receives
+        self.dead_letters = []
+
+    def send(self, image_keys, delay_seconds=0):
+        # A sent key is a new message, so its receive count starts over
+        with self._lock:
+            if delay_seconds:
+                self._delayed.extend((time.monotonic() + delay_seconds, key) for key in image_keys)
+            else:
+                self._pending.extend(image_keys)
+            for key in image_keys:
+                self._receives[key] = 0
+        return []
+
+    def _release_delayed(self):
+        now = time.monotonic()
+        self._pending.extend(key for visible_at, key in self._delayed if visible_at <= now)
+        self._delayed = [(visible_at, key) for visible_at, key in self._delayed if visible_at > now]
+
+    def receive(self, max_items=QUEUE_SEND_BATCH):
+        with self._lock:
+            self._release_delayed()
+            items, self._pending = self._pending[:max_items], self._pending[max_items:]
+            for key in items:
+                self._receives[key] = self._receives.get(key, 0) + 1
+            return items
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending) + len(self._delayed)
+
+    def wait_for_delayed(self, max_seconds):
+        # Sleeps until the next delayed message becomes visible; False if that is more
+        # than max_seconds away
+        with self._lock:
+            self._release_delayed()
+            if self._pending or not self._delayed:
+                return True
+            wait = min(visible_at for visible_at, _ in self._delayed) - time.monotonic()
+        if wait > max_seconds:
+            return False
+        time.sleep(max(0.0, wait))
+        return True
+
+    def nack(self, image_key):
+        # Redeliver, or dead-letter after max_receives like the SQS redrive policy
+        with self._lock:
+            if self._receives.get(image_key, 0) >= self.max_receives:
+                self.dead_letters.append(image_key)
+            else:
+                self._pending.append(image_key)
+
+def queued_images(body):
+    """
+    (image_key, size_bytes) pairs from one queue message: either a planner message or an
+    S3 ObjectCreated notification (s3:TestEvent and other prefixes yield nothing).
+    """
+    if 'image_key' in body:
+        return [(body['image_key'], body.get('size_bytes', 0))]
+    images = []
+    for record in body.get('Records', []):
+        key = unquote_plus(record['s3']['object']['key'])
+        if (key.endswith('.jpg') or key.endswith('.png')) and IMAGE_PREFIX in key:
+            images.append((key, record['s3']['object'].get('size', 0)))
+    return images
+
+def get_work_queue():
+    return SQSWorkQueue(WORK_QUEUE_URL) if WORK_QUEUE_URL else LocalWorkQueue()
+
+def plan_discovery(prefix, queue):
+    """
+    Planner: lists the image prefix and the matching JSON prefix once each and queues
+    every image whose output is missing. Returns the queued keys.
+    """
+    print(f"🕵️ Planning discovery in: {prefix}")
+    output_index_prefix = prefix.replace(IMAGE_PREFIX, OUTPUT_PREFIX) if prefix.startswith(IMAGE_PREFIX) else OUTPUT_PREFIX
+    build_existence_index(output_index_prefix)
+
+    pending = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for listing in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in listing.get('Contents', []):
+            key = obj['Key']
+            if (key.endswith('.jpg') or key.endswith('.png')) and IMAGE_PREFIX in key:
+                if not file_exists_in_s3(S3_BUCKET, output_key_for(key)):
+                    pending.append(key)
+                    _image_sizes[key] = obj['Size']
+
+    queue.send(pending)
+    save_existence_manifest(output_index_prefix)
+    print(f"📋 Queued {len(pending)} pending pages from {prefix}")
+    return pending
+
+def work_items(image_keys, context, timeout_seconds=None):
+    """
+    Worker: processes a batch of queued pages concurrently. Returns (retry, deferred,
+    waiting): keys that failed or errored and must be redelivered, keys not started
+    because they would not finish inside the remaining time, and keys whose image another
+    worker is parsing (requeue them with a delay). Empty pages are settled.
+    """
+    budget = InvocationBudget(context, timeout_seconds)
+
+    def process_in_time(keys):
+        predicted = max(latency.predict_page(_image_sizes.get(key, 0)) for key in keys)
+        if not budget.can_start(predicted):
+            budget.defer(len(keys))
+            return ["deferred"] * len(keys)
+        print(f"Processing queued images: {keys} (predicted {predicted:.0f}s, {budget.remaining():.0f}s left)")
+        started = time.monotonic()
+        results = process_image_group(keys, claim=True)
+        budget.record(len(keys), time.monotonic() - started)
+        return results
+
+    groups = group_for_batching(image_keys)
+    with ThreadPoolExecutor(max_workers=PARSER_CONCURRENCY) as executor:
+        statuses = dict(zip([k for group in groups for k in group],
+                            [r for results in executor.map(process_in_time, groups) for r in results]))
+    results = list(statuses.values())
+    print(f"📊 Worker batch: { {r: results.count(r) for r in set(results)} }")
+    budget.report()
+    return ([key for key, status in statuses.items() if status in ("failed", "error")],
+            [key for key, status in statuses.items() if status == "deferred"],
+            [key for key, status in statuses.items() if status == "waiting"])
+
+def drain_local_queue(queue, context, workers=PARSER_CONCURRENCY, timeout_seconds=None):
+    """
+    Local stand-in for the event source mapping: workers pull until the queue is empty.
+    Nothing redelivers to a later invocation here, so once a page is deferred for time
+    the drain stops and what's left waits for the next discovery run.
+    """
+    timeout_seconds = timeout_seconds or context.get_remaining_time_in_millis() / 1000
+    out_of_time = threading.Event()
+
+    def worker():
+        while not out_of_time.is_set():
+            items = queue.receive()
+            if not items:
+                return
+            retry, deferred, waiting = work_items(items, context, timeout_seconds)
+            for key in retry:
+                queue.nack(key)
+            if deferred:
+                out_of_time.set()
+            queue.send(deferred)
+            queue.send(waiting, delay_seconds=PARSE_CLAIM_WAIT_SECONDS)
+
+    # Another round picks up pages nacked after the other workers had already finished
+    while queue.pending_count() and not out_of_time.is_set():
+        if queue.wait_for_delayed(context.get_remaining_time_in_millis() / 1000 - TIME_BUDGET_MARGIN_SECONDS) is False:
+            break
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(worker) for _ in range(workers)]:
+                future.result()
+    if queue.pending_count():
+        print(f"⏳ Out of time with {queue.pending_count()} pages queued, leaving them for the next discovery run")
+    if queue.dead_letters:
+        print(f"☠️ {len(queue.dead_letters)} pages failed repeatedly: {queue.dead_letters}")
+
+class GeminiBatchEndpoint:
+    """
+    Uploads page images and the JSONL request file through the Gemini Files API and
+    runs them as a batch job.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, data, mime_type, display_name):
+        # Returns (uri for file_data, name to delete it by)
+        uploaded = self.client.files.upload(
+            file=io.BytesIO(data),
+            config=types.UploadFileConfig(display_name=display_name, mime_type=mime_type)
+        )
+        return uploaded.uri, uploaded.name
+
+    def delete(self, file_name):
+        self.client.files.delete(name=file_name)
+
+    def submit(self, requests_path, model_id, display_name):
+        uploaded = self.client.files.upload(
+            file=str(requests_path),
+            config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl")
+        )
+        job = self.client.batches.create(model=model_id, src=uploaded.name, config={"display_name": display_name})
+        return job.name
+
+    def state(self, job_name):
+        return self.client.batches.get(name=job_name).state.name
+
+    def results(self, job_name):
+        job = self.client.batches.get(name=job_name)
+        return self.client.files.download(file=job.dest.file_name).decode("utf-8").splitlines()
+
+class LocalBatchEndpoint:
+    """
+    Stand-in for the Files and Batches APIs so the submit/poll/fan-out flow runs without
+    the network. Each request is answered by `responder(key, request)`, which returns the
+    products (an empty list by default); jobs finish on the first poll.
+    """
+    def __init__(self, root, responder=None):
+        self.root = root
+        self.responder = responder or (lambda key, request: [])
+
+    def upload(self, data, mime_type, display_name):
+        path = os.path.join(self.root, "files", hashlib.sha256(display_name.encode()).hexdigest()[:16])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return f"local-files/{os.path.basename(path)}", path
+
+    def delete(self, file_name):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+    def submit(self, requests_path, model_id, display_name):
+        job_dir = os.path.join(self.root, display_name)
+        os.makedirs(job_dir, exist_ok=True)
+        shutil.move(requests_path, os.path.join(job_dir, "requests.jsonl"))
+        return f"local-batches/{display_name}"
+
+    def state(self, job_name):
+        job_dir = os.path.join(self.root, job_name.split("/", 1)[1])
+        if not os.path.exists(os.path.join(job_dir, "results.jsonl")):
+            with open(os.path.join(job_dir, "requests.jsonl")) as source, open(os.path.join(job_dir, "results.jsonl"), "w") as results:
+                for line in source:
+                    entry = json.loads(line)
+                    products = self.responder(entry["key"], entry["request"])
+                    response = {"candidates": [{"content": {"parts": [{"text": json.dumps(products)}], "role": "model"}}]}
+                    results.write(json.dumps({"key": entry["key"], "response": response}) + "\n")
+        return "JOB_STATE_SUCCEEDED"
+
+    def results(self, job_name):
+        with open(os.path.join(self.root, job_name.split("/", 1)[1], "results.jsonl")) as f:
+            return f.read().splitlines()
+
+class LocalS3:
+    """
+    Directory-backed stand-in for the S3 calls the parser makes (keys are paths under
+    root, the bucket is ignored), so the batch flow can run on local files.
+    """
+    def __init__(self, root="."):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _missing(self, key, operation):
+        return botocore_exceptions.ClientError({"Error": {"Code": "NoSuchKey", "Message": key}}, operation)
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self._path(Key), "rb") as f:
+                return {"Body": io.BytesIO(f.read()), "Metadata": {}}
+        except FileNotFoundError:
+            raise self._missing(Key, "GetObject")
+
+    def head_object(self, Bucket, Key):
+        if not os.path.isfile(self._path(Key)):
+            raise self._missing(Key, "HeadObject")
+        return {"ContentLength": os.path.getsize(self._path(Key))}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        os.makedirs(os.path.dirname(self._path(Key)) or ".", exist_ok=True)
+        with open(self._path(Key), "wb") as f:
+            f.write(Body.encode("utf-8") if isinstance(Body, str) else Body)
+
+    def delete_object(self, Bucket, Key):
+        if os.path.isfile(self._path(Key)):
+            os.remove(self._path(Key))
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, **kwargs):
+        contents, common = [], set()
+        for root, _, files in os.walk(self._path(Prefix[:Prefix.rfind("/") + 1])):
+            for name in files:
+                key = os.path.relpath(os.path.join(root, name), self.root).replace(os.sep, "/")
+                if not key.startswith(Prefix):
+                    continue
+                if Delimiter and Delimiter in key[len(Prefix):]:
+                    common.add(Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter)
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                contents.append({"Key": key, "Size": stat.st_size,
+                                 "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc)})
+        return {"Contents": sorted(contents, key=lambda obj: obj["Key"]),
+                "CommonPrefixes": [{"Prefix": prefix} for prefix in sorted(common)]}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, **kwargs):
+        return [self.list_objects_v2(**kwargs)]
+
+def get_batch_endpoint():
+    if BATCH_ENDPOINT == "local":
+        return LocalBatchEndpoint("/tmp/batch_jobs")
+    return GeminiBatchEndpoint(get_genai_clients()[0])
+
+def batch_request_line(s3_key, mime_type, file_uri):
+    """
+    One line of the batch submission file: the same prompt process_image sends, with the
+    page image referenced by its uploaded file instead of inlined.
+    """
+    return json.dumps({
+        "key": s3_key,
+        "request": {
+            "contents": [{"role": "user", "parts": [
+                {"file_data": {"mime_type": mime_type, "file_uri": file_uri}},
+                {"text": "Extract grocery data according to system instructions."}
+            ]}],
+            "system_instruction": {"parts": [{"text": SYSTEM_INSTRUCTION}]},
+            "generation_config": {"response_mime_type": "application/json"}
+        }
+    })
+
+def batch_result_products(entry):
+    # Result lines carry either a GenerateContentResponse or an error
+    if "error" in entry or "response" not in entry:
+        return None
+    parts = entry["response"].get("candidates", [{}])[0].get("content", {}).get("parts", [])
+    text = "".join(part.get("text", "") for part in parts)
+    try:
+        return json.loads(text) if text else None
+    except json.JSONDecodeError:
+        return None
+
+def fan_out_batch_results(result_lines, pages, write):
+    """
+    Writes each answered page through `write(page, products)`. Pages without a usable
+    answer are left for normal discovery. Returns (written, failed) counts.
+    """
+    written, failed = 0, 0
+    for line in result_lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        page = pages.get(entry.get("key"))
+        products = batch_result_products(entry)
+        if page is None or not products:
+            failed += 1
+            continue
+        write(page, products)
+        written += 1
+    return written, failed
+
+def submit_batch_job(prefix, endpoint=None):
+    """
+    Uploads every pending page under the prefix, submits one job referencing them and
+    saves the page mapping to S3 for poll_batch_jobs. Returns the job's display name.
+    """
+    endpoint = endpoint or get_batch_endpoint()
+    output_index_prefix = prefix.replace(IMAGE_PREFIX, OUTPUT_PREFIX) if prefix.startswith(IMAGE_PREFIX) else OUTPUT_PREFIX
+    build_existence_index(output_index_prefix)
+
+    display_name = f"pnp-backfill-{int(time.time())}"
+    requests_path = f"/tmp/{display_name}.jsonl"
+    image_keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for listing in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        for obj in listing.get('Contents', []):
+            key = obj['Key']
+            if (key.endswith('.jpg') or key.endswith('.png')) and IMAGE_PREFIX in key:
+                image_keys.append(key)
+
+    def stage(key):
+        # Only the request line and page mapping outlive this call, not the image bytes
+        status, page = load_page(key)
+        if status:
+            return None
+        blob = page["image_part"].inline_data
+        try:
+            file_uri, file_name = endpoint.upload(blob.data, blob.mime_type, key)
+        except Exception as e:
+            print(f"❌ Could not upload {key}, leaving it for discovery: {e}")
+            return None
+        return batch_request_line(key, blob.mime_type, file_uri), {
+            "s3_key": key, "output_key": page["output_key"], "image_hash": page["image_hash"], "file_name": file_name}
+
+    pages = {}
+    with open(requests_path, "w") as f, ThreadPoolExecutor(max_workers=PARSER_CONCURRENCY) as executor:
+        for staged in executor.map(stage, image_keys):
+            if staged:
+                f.write(staged[0] + "\n")
+                pages[staged[1]["s3_key"]] = staged[1]
+
+    if not pages:
+        print(f"No pending pages under {prefix}, nothing to submit.")
+        os.remove(requests_path)
+        return None
+
+    job_name = endpoint.submit(requests_path, BATCH_MODEL, display_name)
+    print(f"📨 Submitted batch job {job_name} with {len(pages)} uploaded pages ({BATCH_MODEL})")
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=f"{BATCH_JOB_PREFIX}{display_name}.json",
+        Body=json.dumps({"job_name": job_name, "model": BATCH_MODEL, "prefix": prefix, "pages": pages}),
+        ContentType='application/json'
     )
+    return display_name
+
+def collect_batch_job(display_name, endpoint=None):
+    """
+    Checks the job once. A finished job is fanned out into the normal output keys, its
+    uploaded pages are deleted and its manifest moves to BATCH_DONE_PREFIX. Returns the
+    job state.
+    """
+    endpoint = endpoint or get_batch_endpoint()
+    manifest_key = f"{BATCH_JOB_PREFIX}{display_name}.json"
+    job = json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=manifest_key)['Body'].read())
+
+    state = endpoint.state(job["job_name"])
+    if state not in BATCH_DONE_STATES:
+        print(f"⏳ Batch job {job['job_name']} still {state}")
+        return state
+
+    if state == "JOB_STATE_SUCCEEDED":
+        def write(page, products):
+            upload_to_s3(products, page["output_key"])
+            store_parse_cache(page["image_hash"], job["model"], products)
+
+        written, failed = fan_out_batch_results(endpoint.results(job["job_name"]), job["pages"], write)
+        print(f"📦 Batch job {job['job_name']}: {written} pages written, {failed} without a usable answer")
+    else:
+        print(f"❌ Batch job {job['job_name']} ended as {state}; pages are left for discovery.")
+
+    for page in job["pages"].values():
+        try:
+            endpoint.delete(page["file_name"])
+        except Exception as e:
+            print(f"Could not delete uploaded page {page['file_name']} (it expires on its own): {e}")
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=f"{BATCH_DONE_PREFIX}{display_name}.json",
+        Body=json.dumps(dict(job, state=state)),
+        ContentType='application/json'
+    )
+    s3_client.delete_object(Bucket=S3_BUCKET, Key=manifest_key)
+    return state
+
+def poll_batch_jobs(endpoint=None):
+    """
+    Scheduled poll: checks every open job manifest once. Returns {display_name: state}.
+    """
+    states = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for listing in paginator.paginate(Bucket=S3_BUCKET, Prefix=BATCH_JOB_PREFIX, Delimiter='/'):
+        for obj in listing.get('Contents', []):
+            if obj['Key'].endswith('.json'):
+                display_name = obj['Key'][len(BATCH_JOB_PREFIX):-len('.json')]
+                states[display_name] = collect_batch_job(display_name, endpoint)
+    if states:
+        print(f"📦 Polled {len(states)} open batch jobs: {states}")
+    return states
+
+def reset_invocation_stats():
+    # The reports printed at the end of an invocation cover that invocation only
+    with _parse_cache_lock:
+        parse_cache_stats.update(hits=0, misses=0)
+    with _image_prep_lock:
+        image_prep_stats.update(pages=0, resized=0, prep_cpu_s=0.0, saved_cpu_s=0.0)
+    with _cascade_lock:
+        cascade_stats.clear()
+    prompt_cache.reset_stats()
+
+_cold_start = True
+
+def report_init_profile():
+    global _cold_start
+    if not _cold_start:
+        return
+    _cold_start = False
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in init_profile.items())
+    print(f"🥶 Cold start profile: {steps}")
 
 def lambda_handler(event, context):
     """
-    Handles both S3 events and recursive discovery events.
+    Entry point for queued pages (SQS batches fed by the planner and the bucket's image
+    notifications), discovery planning, batch-job backfills and direct S3 events.
     """
-    # 1. Check for Discovery/Crawl mode
+    # Existence indexes are only trusted for the invocation that built them
+    _existing_keys.clear()
+    # Key health persists in this container; what other invocations have learned is
+    # merged in by the first Gemini call
+    health.begin_invocation()
+    reset_invocation_stats()
+    timeout_seconds = context.get_remaining_time_in_millis() / 1000
+    try:
+        return handle_event(event, context, timeout_seconds)
+    finally:
+        health.report()
+        health.save()
+        report_parse_cache()
+        report_image_prep()
+        report_cascade()
+        prompt_cache.report()
+        report_init_profile()
+
+def handle_event(event, context, timeout_seconds=None):
+    # 0. Batch-job backfill: submit everything pending under a prefix; the scheduled
+    # batch_poll (or a batch_job check) fans the results out once the job finishes
+    if 'batch_prefix' in event:
+        display_name = submit_batch_job(event['batch_prefix'])
+        return {'statusCode': 200, 'body': json.dumps({'batch_job': display_name})}
+    if 'batch_poll' in event:
+        return {'statusCode': 200, 'body': json.dumps(poll_batch_jobs())}
+    if 'batch_job' in event:
+        state = collect_batch_job(event['batch_job'])
+        return {'statusCode': 200, 'body': json.dumps({'batch_job': event['batch_job'], 'state': state})}
+
+    # 1. Check for Discovery/Crawl mode: plan the pending pages into the work queue
     if 'discovery_prefix' in event:
-        discover_and_process(event['discovery_prefix'], event.get('continuation_token'), context)
-        return {'statusCode': 200, 'body': 'Discovery initiated'}
+        queue = get_work_queue()
+        pending = plan_discovery(event['discovery_prefix'], queue)
+        if isinstance(queue, LocalWorkQueue):
+            drain_local_queue(queue, context, timeout_seconds=timeout_seconds)
+        return {'statusCode': 200, 'body': json.dumps({'queued': len(pending)})}
 
-    # 2. Check for S3 Events
+    # 2. Queue workers: planner messages and the bucket's image notifications both land
+    # in the work queue, so every page goes through the same concurrency cap and limiter
+    if event.get('Records') and event['Records'][0].get('eventSource') == 'aws:sqs':
+        message_ids = {}
+        for record in event['Records']:
+            for image_key, size_bytes in queued_images(json.loads(record['body'])):
+                message_ids[image_key] = record['messageId']
+                _image_sizes[image_key] = size_bytes
+        retry, deferred, waiting = work_items(list(message_ids), context, timeout_seconds)
+        # Deferred and waiting pages were never attempted: queue them as new messages (the
+        # originals are deleted with the batch) so they don't use up receives towards the DLQ
+        for keys, delay_seconds in ((deferred, 0), (waiting, PARSE_CLAIM_WAIT_SECONDS)):
+            if not keys:
+                continue
+            try:
+                retry += get_work_queue().send(keys, delay_seconds=delay_seconds)
+            except botocore_exceptions.ClientError as e:
+                print(f"❌ Could not requeue {len(keys)} pages, leaving them to redelivery: {e}")
+                retry += keys
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in {message_ids[key] for key in retry}]}
+
+    # 3. Check for S3 Events
+    image_keys = []
     for record in event.get('Records', []):
         key = record['s3']['object']['key']
-        if (key.endswith('.jpg') or key.endswith('.png')) and 'data/interim/images/PnP/' in key:
+        if (key.endswith('.jpg') or key.endswith('.png')) and IMAGE_PREFIX in key:
             print(f"Processing new image: {key}")
-            process_image(key)
+            image_keys.append(key)
+    with ThreadPoolExecutor(max_workers=PARSER_CONCURRENCY) as executor:
+        list(executor.map(process_image_group, group_for_batching(image_keys)))
             
     return {
         'statusCode': 200,
         'body': json.dumps('Vision parsing complete')
     }
+
+init_profile["module import"] = time.perf_counter() - _import_started
+
+def run_local_batch(image_dir, fixtures_path=None):
+    """
+    Runs the real submit and collect steps on local files: LocalS3 stands in for the
+    bucket (keys are paths under the working directory) and LocalBatchEndpoint for
+    Gemini. Pages under image_dir (e.g. data/interim/images/PnP/Gauteng) are written to
+    data/pro/json/PnP/. Optional fixtures map page keys to the products to answer with.
+    """
+    global s3_client, S3_BUCKET
+    fixtures = {}
+    if fixtures_path:
+        with open(fixtures_path) as f:
+            fixtures = json.load(f)
+    s3_client = LocalS3(".")
+    S3_BUCKET = S3_BUCKET or "local"
+    endpoint = LocalBatchEndpoint("data/interim/batch_jobs", lambda key, request: fixtures.get(key, []))
+
+    display_name = submit_batch_job(image_dir.rstrip("/") + "/", endpoint)
+    if display_name:
+        print(f"Job state: {collect_batch_job(display_name, endpoint)}")
+    return display_name
+
+if __name__ == "__main__":
+    # python3 pnp-vision-parserLambda.py data/interim/images/PnP/Gauteng [fixtures.json]
+    import sys
+    run_local_batch(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
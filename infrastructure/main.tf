@@ -120,6 +120,37 @@ resource "aws_iam_role_policy_attachment" "lambda_invoke" {
   policy_arn = aws_iam_policy.lambda_invoke_policy.arn
 }
 
+# SQS Permission for the vision parser work queue (planner sends, workers drain)
+resource "aws_iam_policy" "lambda_sqs_policy" {
+  name        = "${var.project_name}-sqs-policy"
+  description = "Permissions for the vision parser page queue"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:ChangeMessageVisibility",
+          "sqs:GetQueueAttributes"
+        ]
+        Effect   = "Allow"
+        Resource = [
+          aws_sqs_queue.parser_queue.arn,
+          aws_sqs_queue.parser_dlq.arn
+        ]
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "lambda_sqs" {
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = aws_iam_policy.lambda_sqs_policy.arn
+}
+
 resource "aws_lambda_function" "scraper" {
   function_name = "${var.project_name}-scraper"
   role          = aws_iam_role.lambda_role.arn
@@ -146,6 +177,7 @@ resource "aws_lambda_function" "pdf_converter" {
   environment {
     variables = {
       S3_BUCKET_NAME = data.aws_s3_bucket.data_bucket.id
+      SPLIT_MODE     = "true" # Large flyers fan out into page-range invocations
     }
   }
 }
@@ -158,14 +190,74 @@ resource "aws_lambda_function" "vision_parser" {
   timeout       = 900
   memory_size   = 1024
 
+  # /tmp holds batch request files; page images go to Gemini through the Files API
+  ephemeral_storage {
+    size = 1024
+  }
+
   environment {
     variables = {
       S3_BUCKET_NAME          = data.aws_s3_bucket.data_bucket.id
       GEMINI_API_KEY_SSM_NAME = var.gemini_api_key_ssm_name
+      WORK_QUEUE_URL          = aws_sqs_queue.parser_queue.url
+      PARSER_WORKERS          = var.parser_max_workers # Each worker gets this share of every key's quota
+      PARSE_CACHE_TTL_DAYS    = var.parse_cache_ttl_days
+    }
+  }
+}
+
+# Parse cache entries expire here rather than on lookup, so pages that are never seen
+# again don't stay forever. Note: this resource owns the bucket's lifecycle rules.
+resource "aws_s3_bucket_lifecycle_configuration" "parse_cache_expiry" {
+  bucket = data.aws_s3_bucket.data_bucket.id
+
+  rule {
+    id     = "expire-parse-cache"
+    status = "Enabled"
+
+    filter {
+      prefix = "data/interim/parse_cache/PnP/"
+    }
+
+    expiration {
+      days = var.parse_cache_ttl_days
     }
   }
 }
 
+# --- Vision Parser Work Queue ---
+# Discovery plans pending pages into this queue; parser workers drain it in parallel.
+# Pages that fail or run out of time are reported back and redelivered, then dead-lettered.
+resource "aws_sqs_queue" "parser_dlq" {
+  name                      = "${var.project_name}-parser-dlq"
+  message_retention_seconds = 1209600
+}
+
+resource "aws_sqs_queue" "parser_queue" {
+  name                       = "${var.project_name}-parser-queue"
+  visibility_timeout_seconds = 960 # Must outlive the 900s parser timeout
+  message_retention_seconds  = 345600
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.parser_dlq.arn
+    maxReceiveCount     = 5
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "parser_queue_workers" {
+  event_source_arn                   = aws_sqs_queue.parser_queue.arn
+  function_name                      = aws_lambda_function.vision_parser.arn
+  batch_size                         = 10
+  maximum_batching_window_in_seconds = 5
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  scaling_config {
+    maximum_concurrency = var.parser_max_workers
+  }
+
+  depends_on = [aws_iam_role_policy_attachment.lambda_sqs]
+}
+
 resource "aws_lambda_function" "cropper" {
   function_name = "${var.project_name}-cropper"
   role          = aws_iam_role.lambda_role.arn
@@ -207,12 +299,25 @@ resource "aws_lambda_permission" "allow_s3_converter" {
   source_arn    = data.aws_s3_bucket.data_bucket.arn
 }
 
-resource "aws_lambda_permission" "allow_s3_parser" {
-  statement_id  = "AllowExecutionFromS3"
-  action        = "lambda:InvokeFunction"
-  function_name = aws_lambda_function.vision_parser.function_name
-  principal     = "s3.amazonaws.com"
-  source_arn    = data.aws_s3_bucket.data_bucket.arn
+# New page images go to the parser work queue instead of invoking the parser directly,
+# so a burst of converted pages is drained by at most parser_max_workers containers
+resource "aws_sqs_queue_policy" "allow_s3_parser_queue" {
+  queue_url = aws_sqs_queue.parser_queue.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect    = "Allow"
+        Principal = { Service = "s3.amazonaws.com" }
+        Action    = "sqs:SendMessage"
+        Resource  = aws_sqs_queue.parser_queue.arn
+        Condition = {
+          ArnEquals = { "aws:SourceArn" = data.aws_s3_bucket.data_bucket.arn }
+        }
+      }
+    ]
+  })
 }
 
 resource "aws_lambda_permission" "allow_data_cleaner_to_invoke_cropper" {
@@ -241,11 +346,11 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
     filter_suffix       = ".pdf"
   }
 
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.vision_parser.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_prefix       = "data/interim/images/PnP/"
-    filter_suffix       = ".jpg"
+  queue {
+    queue_arn     = aws_sqs_queue.parser_queue.arn
+    events        = ["s3:ObjectCreated:*"]
+    filter_prefix = "data/interim/images/PnP/"
+    filter_suffix = ".jpg"
   }
 
   lambda_function {
@@ -257,7 +362,7 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
 
   depends_on = [
     aws_lambda_permission.allow_s3_converter,
-    aws_lambda_permission.allow_s3_parser,
+    aws_sqs_queue_policy.allow_s3_parser_queue,
     aws_lambda_permission.allow_s3_cleaner
   ]
 }
@@ -283,6 +388,30 @@ resource "aws_lambda_permission" "allow_eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.daily_scrape.arn
 }
 
+# --- Schedule for Parser Batch Jobs ---
+# Checks open Gemini batch jobs and fans finished ones out, instead of a parser
+# invocation sleeping until its job is done
+resource "aws_cloudwatch_event_rule" "parser_batch_poll" {
+  name                = "${var.project_name}-parser-batch-poll"
+  description         = "Polls open vision parser batch jobs"
+  schedule_expression = "rate(15 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "poll_parser_batches" {
+  rule      = aws_cloudwatch_event_rule.parser_batch_poll.name
+  target_id = "VisionParserBatchPoll"
+  arn       = aws_lambda_function.vision_parser.arn
+  input     = jsonencode({ batch_poll = true })
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_parser" {
+  statement_id  = "AllowBatchPollFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.vision_parser.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.parser_batch_poll.arn
+}
+
 # --- AWS Glue Data Catalog & Crawler ---
 
 resource "aws_glue_catalog_database" "specials_db" {
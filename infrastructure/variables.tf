@@ -21,3 +21,15 @@ variable "gemini_api_key_ssm_name" {
   type        = string
   default     = "/SpecialsID/gemini-api-key"
 }
+
+variable "parser_max_workers" {
+  description = "Maximum parallel vision parser workers draining the page queue"
+  type        = number
+  default     = 4
+}
+
+variable "parse_cache_ttl_days" {
+  description = "Days before vision parser cache entries expire"
+  type        = number
+  default     = 30
+}
@@ -5,7 +5,6 @@ from pathlib import Path
 from google import genai
 from dotenv import load_dotenv
 from google.genai import types
-from PIL import Image
 
 # 1. Configuration
 INTERIM_DIR = Path("data/interim/images")
@@ -65,11 +64,13 @@ def process_image(image_path: Path):
         model_id = get_current_model()
         try:
             print(f"🔍 Processing: {relative_path} (Model: {model_id})")
-            img = Image.open(image_path)
+            # Send the page bytes as rendered; no PIL decode and SDK re-encode per call
+            mime_type = "image/png" if image_path.suffix.lower() == ".png" else "image/jpeg"
+            image_part = types.Part.from_bytes(data=image_path.read_bytes(), mime_type=mime_type)
             
             response = client.models.generate_content(
                 model=model_id,
-                contents=[img, "Extract grocery data according to system instructions."],
+                contents=[image_part, "Extract grocery data according to system instructions."],
                 config=types.GenerateContentConfig(
                     system_instruction=SYSTEM_INSTRUCTION,
                     response_mime_type="application/json"
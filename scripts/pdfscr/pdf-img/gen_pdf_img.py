@@ -1,6 +1,13 @@
+import io
 import os
+import json
+import time
+import shutil
+import hashlib
 from pathlib import Path
-from pdf2image import convert_from_path
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
 
 # 1. Setup Path Independence
 # This locates the 'SpecialsID' root folder relative to this script's location
@@ -10,6 +17,100 @@ PROJECT_ROOT = SCRIPT_PATH.parents[3]  # Go up three levels (from scripts/pdfscr
 # 2. Define Medallion Layer Paths
 BRONZE_DIR = PROJECT_ROOT / "data" / "raw" / "PnP"
 INTERIM_DIR = PROJECT_ROOT / "data" / "interim" / "images" / "PnP"
+# Render cache keyed by PDF content hash and profile: render_cache/PnP/{sha256}/{profile}/page_{n}.jpg
+RENDER_CACHE_DIR = PROJECT_ROOT / "data" / "interim" / "render_cache" / "PnP"
+
+# Pages rendered per poppler call, keeps memory flat on long flyers
+RENDER_WINDOW = 1
+# Named rendering profiles, kept in step with the pdf_converter Lambda.
+# "default" is the original 300 DPI / default-quality JPEG output.
+RENDER_PROFILES = {
+    "default": {"dpi": 300, "max_long_edge": None, "format": "JPEG", "quality": 75, "progressive": False},
+    "vision": {"dpi": 200, "max_long_edge": 3072, "format": "JPEG", "quality": 85, "progressive": True},
+    "vision-lite": {"dpi": 150, "max_long_edge": 2048, "format": "JPEG", "quality": 80, "progressive": True},
+}
+RENDER_PROFILE = os.environ.get("RENDER_PROFILE", "default")
+# One poppler process per worker, spread across the available cores
+RENDER_WORKERS = os.cpu_count() or 1
+
+def encode_page(image, profile):
+    # Downscale to the profile's long edge (if any) and encode, returning the bytes
+    max_long_edge = profile.get("max_long_edge")
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+    buffer = io.BytesIO()
+    save_options = {"quality": profile["quality"]}
+    if profile["format"] == "JPEG" and profile.get("progressive"):
+        save_options.update(progressive=True, optimize=True)
+    image.save(buffer, profile["format"], **save_options)
+    return buffer.getvalue()
+
+def render_window(pdf_path, first_page, last_page, output_path, profile_name=RENDER_PROFILE):
+    # Render and encode one page window, returning (page_number, render_seconds, encode_seconds)
+    profile = RENDER_PROFILES[profile_name]
+    started = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=profile["dpi"], first_page=first_page, last_page=last_page)
+    render_seconds = (time.perf_counter() - started) / max(len(images), 1)
+
+    pages = []
+    for offset, image in enumerate(images):
+        page_number = first_page + offset
+        started = time.perf_counter()
+        (output_path / f"page_{page_number}.jpg").write_bytes(encode_page(image, profile))
+        image.close()
+        pages.append((page_number, render_seconds, time.perf_counter() - started))
+    return pages
+
+def convert_pdf_parallel(pdf_path, output_path):
+    # Spread page windows over RENDER_WORKERS and return a per-flyer timing report
+    started = time.perf_counter()
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    report = {"pages": page_count, "render_s": 0.0, "encode_s": 0.0}
+    windows = [
+        (first_page, min(first_page + RENDER_WINDOW - 1, page_count))
+        for first_page in range(1, page_count + 1, RENDER_WINDOW)
+    ]
+    with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as pool:
+        futures = [pool.submit(render_window, pdf_path, first, last, output_path) for first, last in windows]
+        for future in futures:
+            for page_number, render_s, encode_s in future.result():
+                report["render_s"] += render_s
+                report["encode_s"] += encode_s
+                print(f"    - Saved Page {page_number}")
+    report["wall_s"] = time.perf_counter() - started
+    return report
+
+def sha256_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_file(src_path, dst_path):
+    # Hard link where possible so cached pages cost no extra disk
+    if dst_path.exists():
+        dst_path.unlink()
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+def cached_page_count(cache_path):
+    # Returns the page count if every page of this PDF/profile is already in the cache
+    manifest_path = cache_path / "manifest.json"
+    if not manifest_path.exists():
+        return None
+    page_count = json.loads(manifest_path.read_text())["pages"]
+    if all((cache_path / f"page_{n}.jpg").exists() for n in range(1, page_count + 1)):
+        return page_count
+    return None
+
+def store_in_render_cache(output_path, cache_path, page_count):
+    cache_path.mkdir(parents=True, exist_ok=True)
+    for n in range(1, page_count + 1):
+        link_file(output_path / f"page_{n}.jpg", cache_path / f"page_{n}.jpg")
+    (cache_path / "manifest.json").write_text(json.dumps({"pages": page_count}))
 
 def convert_all_flyers():
     print(f"Project Root: {PROJECT_ROOT}")
@@ -42,14 +143,23 @@ def convert_all_flyers():
                 print(f"  Processing: {pdf_file.name}")
                 output_path.mkdir(parents=True, exist_ok=True)
 
+                # Identical flyers (other provinces, re-syncs) reuse pages rendered before
+                cache_path = RENDER_CACHE_DIR / sha256_file(pdf_file) / RENDER_PROFILE
+                page_count = cached_page_count(cache_path)
+                if page_count:
+                    for n in range(1, page_count + 1):
+                        link_file(cache_path / f"page_{n}.jpg", output_path / f"page_{n}.jpg")
+                    print(f"    - Render cache hit, linked {page_count} pages")
+                    continue
+
                 try:
-                    # 5. Convert PDF to High-Res JPEG (300 DPI for AI clarity)
-                    images = convert_from_path(str(pdf_file), dpi=300)
-                    
-                    for i, image in enumerate(images):
-                        image_filename = f"page_{i + 1}.jpg"
-                        image.save(output_path / image_filename, "JPEG")
-                        print(f"    - Saved Page {i + 1}")
+                    # 5. Convert PDF to High-Res JPEG (300 DPI for AI clarity), pages in parallel
+                    report = convert_pdf_parallel(str(pdf_file), output_path)
+                    store_in_render_cache(output_path, cache_path, report["pages"])
+                    print(
+                        f"    - {report['pages']} pages in {report['wall_s']:.1f}s wall "
+                        f"(render {report['render_s']:.1f}s, encode {report['encode_s']:.1f}s across workers)"
+                    )
                 
                 except Exception as e:
                     print(f"    - Error converting {pdf_file.name}: {e}")
@@ -1,8 +1,16 @@
 import os
+import io
+import re
 import json
+import time
+import hashlib
+import subprocess
+import threading
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image, ImageStat
 from botocore.exceptions import ClientError
 
 # S3 Configuration from environment variables
@@ -10,19 +18,434 @@ S3_BUCKET = os.environ.get("S3_BUCKET_NAME")
 # Input: data/raw/PnP/Province/Flyer.pdf
 # Output: data/interim/images/PnP/Province/Flyer/page_1.jpg
 
+# Pages rendered per poppler call. Only RENDER_WORKERS windows of PIL images are
+# alive at once, so peak memory stays flat however long the flyer is.
+RENDER_WINDOW = int(os.environ.get("RENDER_WINDOW", "1"))
+
+# Named rendering profiles. "default" reproduces the original output (300 DPI, PIL's
+# default JPEG quality). Compare them with scripts/pdfscr/pdf-img/render_profile_bench.py.
+# Pipeline output stays JPEG: the S3 trigger, parser and cropper all key on page_N.jpg.
+RENDER_PROFILES = {
+    "default": {"dpi": 300, "max_long_edge": None, "format": "JPEG", "quality": 75, "progressive": False},
+    "vision": {"dpi": 200, "max_long_edge": 3072, "format": "JPEG", "quality": 85, "progressive": True},
+    "vision-lite": {"dpi": 150, "max_long_edge": 2048, "format": "JPEG", "quality": 80, "progressive": True},
+}
+RENDER_PROFILE = os.environ.get("RENDER_PROFILE", "default")
+# Each render worker drives its own pdftoppm process, one per available vCPU
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", str(os.cpu_count() or 1)))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+# Bounded in-flight queue: pages being rendered plus encoded pages waiting for upload
+MAX_IN_FLIGHT_PAGES = RENDER_WORKERS * RENDER_WINDOW + UPLOAD_WORKERS
+# Split mode: large flyers are planned into page ranges rendered by parallel invocations
+SPLIT_MODE = os.environ.get("SPLIT_MODE", "false").lower() == "true"
+SPLIT_PAGES_PER_WORKER = int(os.environ.get("SPLIT_PAGES_PER_WORKER", "4"))
+
+# Page tagging pre-pass: the PDF text layer plus cheap image statistics tag every page as
+# product_grid, cover, legal, blank or unknown (no usable text layer). The tag travels as
+# the page image's "page-type" metadata so the vision parser can skip or down-tier it.
+PRICE_PATTERN = re.compile(r"\bR\s?\d+(?:[.,]\d{2})?\b|\b\d+[.,]\d{2}\b")
+LEGAL_PHRASES = (
+    "terms and conditions", "while stocks last", "errors and omissions", "e&oe",
+    "prices valid", "trading hours", "store locator", "limited stock", "rights reserved",
+)
+BLANK_STDDEV = 6.0  # greyscale stddev below which a page is effectively empty
+
+# Render cache: data/interim/render_cache/PnP/{pdf_sha256}/{profile}/page_{n}.jpg
+# Outside the images prefix so cache writes never trigger the vision parser.
+RENDER_CACHE_PREFIX = "data/interim/render_cache/PnP/"
+# The scraper copies one blob to every province within seconds, so all their converters
+# start together. The first to create {cache}/rendering.json (conditional PUT) renders;
+# the rest copy pages from the cache as they appear. A claim older than
+# RENDER_CLAIM_TTL_SECONDS is treated as abandoned and taken over.
+RENDER_CLAIM_TTL_SECONDS = int(os.environ.get("RENDER_CLAIM_TTL_SECONDS", "600"))
+RENDER_WAIT_POLL_SECONDS = int(os.environ.get("RENDER_WAIT_POLL_SECONDS", "5"))
+
 s3_client = boto3.client('s3')
+lambda_client = boto3.client('lambda')
+# Each render thread encodes into its own reusable buffer instead of /tmp
+_thread_local = threading.local()
 
-def upload_to_s3(local_path, s3_key):
+def upload_to_s3(image_bytes, s3_key, metadata=None):
     if not S3_BUCKET:
-        print(f"S3_BUCKET_NAME not set, skipping upload of {local_path}")
+        print(f"S3_BUCKET_NAME not set, skipping upload of {s3_key}")
         return
     try:
-        s3_client.upload_file(local_path, S3_BUCKET, s3_key)
-        print(f"Successfully uploaded {local_path} to s3://{S3_BUCKET}/{s3_key}")
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=s3_key,
+            Body=image_bytes,
+            ContentType='image/jpeg',
+            Metadata=metadata or {}
+        )
+        print(f"Successfully uploaded {len(image_bytes)} bytes to s3://{S3_BUCKET}/{s3_key}")
+        return True
     except Exception as e:
         print(f"Failed to upload to S3: {e}")
+        return False
+
+def copy_in_s3(source_key, s3_key):
+    try:
+        s3_client.copy_object(Bucket=S3_BUCKET, Key=s3_key, CopySource={'Bucket': S3_BUCKET, 'Key': source_key})
+        return True
+    except Exception as e:
+        print(f"Failed to copy {source_key} to {s3_key}: {e}")
+        return False
+
+def sha256_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_pdf_digest(s3_key):
+    """
+    The scraper stores the PDF's SHA-256 as object metadata, so a HEAD is enough to
+    identify the flyer without downloading it. Returns None for older objects.
+    """
+    if not S3_BUCKET:
+        return None
+    try:
+        return s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key).get('Metadata', {}).get('sha256')
+    except ClientError as e:
+        print(f"Could not read metadata for {s3_key}: {e}")
+        return None
+
+def render_cache_prefix(digest, profile_name=RENDER_PROFILE):
+    return f"{RENDER_CACHE_PREFIX}{digest}/{profile_name}/"
+
+def load_render_cache(cache_prefix):
+    """
+    Returns (page_count or None, set of cached page numbers) with one GET and one listing.
+    """
+    if not S3_BUCKET:
+        return None, set()
+    page_count = None
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=f"{cache_prefix}manifest.json")
+        page_count = json.loads(response['Body'].read())["pages"]
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        return None, set()
+
+    cached_pages = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{cache_prefix}page_"):
+        for obj in page.get('Contents', []):
+            name = os.path.splitext(os.path.basename(obj['Key']))[0]
+            cached_pages.add(int(name.split("_")[1]))
+    return page_count, cached_pages
+
+def save_render_cache_manifest(cache_prefix, page_count):
+    if not S3_BUCKET:
+        return
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=f"{cache_prefix}manifest.json",
+            Body=json.dumps({"pages": page_count}),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Failed to save render cache manifest: {e}")
+
+def copy_cached_pages(cache_prefix, s3_output_prefix, first_page, last_page):
+    """
+    Cache hit: server-side copies every already-rendered page to the new flyer path.
+    No download and no poppler work.
+    """
+    started = time.perf_counter()
+    pages = range(first_page, last_page + 1)
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        copied = sum(pool.map(
+            lambda n: copy_in_s3(f"{cache_prefix}page_{n}.jpg", f"{s3_output_prefix}page_{n}.jpg"), pages))
+    return {"pages": len(pages), "cache_hits": copied, "wall_s": time.perf_counter() - started}
+
+def claim_render(cache_prefix, s3_key, retake=True):
+    """
+    Returns True if this invocation should render the digest. Only one invocation can
+    create the claim object; an expired claim is deleted and claimed again once.
+    """
+    if not S3_BUCKET:
+        return True
+    claim_key = f"{cache_prefix}rendering.json"
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=claim_key,
+            Body=json.dumps({"s3_key": s3_key, "claimed_at": time.time()}),
+            ContentType='application/json',
+            IfNoneMatch='*'
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+            raise
+    try:
+        claim = json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=claim_key)['Body'].read())
+    except ClientError:
+        claim = {}
+    if retake and time.time() - claim.get("claimed_at", 0) > RENDER_CLAIM_TTL_SECONDS:
+        print(f"Render claim on {cache_prefix} by {claim.get('s3_key')} expired, taking over")
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=claim_key)
+        return claim_render(cache_prefix, s3_key, retake=False)
+    print(f"⏳ {claim.get('s3_key')} is already rendering this PDF, waiting for the cache")
+    return False
+
+def release_render_claim(cache_prefix):
+    # Only on failure: a finished render leaves the claim, later runs hit the cache first
+    try:
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=f"{cache_prefix}rendering.json")
+    except Exception as e:
+        print(f"Failed to release render claim on {cache_prefix}: {e}")
+
+def await_render(cache_prefix, s3_key, s3_output_prefix, digest, context=None):
+    """
+    Copies pages into s3_output_prefix as the claiming invocation caches them. When this
+    invocation runs low on time it re-invokes itself to keep waiting.
+    """
+    # Pages a previous (re-queued) wait already copied are not copied again
+    copied = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=f"{s3_output_prefix}page_"):
+        for obj in page.get('Contents', []):
+            copied.add(int(os.path.splitext(os.path.basename(obj['Key']))[0].split("_")[1]))
+    started = time.perf_counter()
+    while True:
+        page_count, cached_pages = load_render_cache(cache_prefix)
+        new_pages = sorted(cached_pages - copied)
+        if new_pages:
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+                results = pool.map(
+                    lambda n: copy_in_s3(f"{cache_prefix}page_{n}.jpg", f"{s3_output_prefix}page_{n}.jpg"), new_pages)
+                copied.update(n for n, ok in zip(new_pages, results) if ok)
+        if page_count and len(copied) >= page_count:
+            print(f"♻️ {s3_key}: {len(copied)} pages copied from the shared render in {time.perf_counter() - started:.1f}s")
+            return {"pages": page_count, "cache_hits": len(copied), "wall_s": time.perf_counter() - started}
+
+        remaining = context.get_remaining_time_in_millis() / 1000 if context else RENDER_CLAIM_TTL_SECONDS
+        if remaining < RENDER_WAIT_POLL_SECONDS + 30:
+            print(f"⏳ Still waiting on {cache_prefix} ({len(copied)} pages copied), re-queuing")
+            lambda_client.invoke(
+                FunctionName=os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
+                InvocationType='Event',
+                Payload=json.dumps({'await_render': {'s3_key': s3_key, 'digest': digest}})
+            )
+            return None
+        if not claim_is_live(cache_prefix):
+            # The renderer gave up; the re-queued event will claim and render itself
+            print(f"Render claim on {cache_prefix} was released, re-queuing {s3_key}")
+            lambda_client.invoke(
+                FunctionName=os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
+                InvocationType='Event',
+                Payload=json.dumps({'await_render': {'s3_key': s3_key, 'digest': digest}})
+            )
+            return None
+        time.sleep(RENDER_WAIT_POLL_SECONDS)
+
+def claim_is_live(cache_prefix):
+    try:
+        claim = json.loads(s3_client.get_object(Bucket=S3_BUCKET, Key=f"{cache_prefix}rendering.json")['Body'].read())
+    except ClientError:
+        return False
+    return time.time() - claim.get("claimed_at", 0) <= RENDER_CLAIM_TTL_SECONDS
+
+def extract_page_texts(pdf_path, first_page, last_page):
+    """
+    One pdftotext call for the whole range; pages come back separated by form feeds.
+    Returns {page_number: text}, or {} when the PDF has no readable text layer.
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-f", str(first_page), "-l", str(last_page), pdf_path, "-"],
+            capture_output=True, text=True, timeout=60, check=True
+        )
+    except Exception as e:
+        print(f"Text layer pre-pass failed, pages stay untagged: {e}")
+        return {}
+    return {first_page + offset: text for offset, text in enumerate(result.stdout.split("\f"))}
+
+def classify_page(page_number, text, image):
+    """
+    Tags a page from its text layer and pixel statistics. Anything ambiguous stays
+    product_grid or unknown so it still gets the full vision pass.
+    """
+    greyscale = image.convert("L")
+    greyscale.thumbnail((128, 128))
+    stddev = ImageStat.Stat(greyscale).stddev[0]
+    greyscale.close()
+
+    words = len(text.split())
+    prices = len(PRICE_PATTERN.findall(text))
+    lowered = text.lower()
+    legal_hits = sum(phrase in lowered for phrase in LEGAL_PHRASES)
+
+    if stddev < BLANK_STDDEV and words < 5:
+        return "blank"
+    if words == 0:
+        return "unknown"
+    if prices >= 3:
+        return "product_grid"
+    # Footers like "prices valid" / "while stocks last" sit on most product pages, so a
+    # page is only legal when its text layer has no prices at all (outlined or image
+    # prices still leave the page product_grid for the parser's full pass)
+    if prices == 0 and (legal_hits >= 3 or (legal_hits >= 2 and words > 150)):
+        return "legal"
+    if page_number == 1:
+        return "cover"
+    return "product_grid"
+
+def encode_page(image, profile):
+    """
+    Downscales the page to the profile's long edge (if any) and encodes it into this
+    thread's reusable buffer. Returns the bytes; nothing is written to /tmp.
+    """
+    max_long_edge = profile.get("max_long_edge")
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    buffer = getattr(_thread_local, "buffer", None)
+    if buffer is None:
+        buffer = _thread_local.buffer = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    save_options = {"quality": profile["quality"]}
+    if profile["format"] == "JPEG" and profile.get("progressive"):
+        save_options.update(progressive=True, optimize=True)
+    image.save(buffer, profile["format"], **save_options)
+    return buffer.getvalue()
+
+def render_window(pdf_path, first_page, last_page, page_texts=None, profile_name=RENDER_PROFILE):
+    """
+    Renders, tags and encodes one first_page/last_page window in memory.
+    page_texts: {page_number: text} from extract_page_texts(); without it pages are "unknown".
+    Returns [(page_number, jpeg_bytes, metadata, render_seconds, encode_seconds)].
+    """
+    profile = RENDER_PROFILES[profile_name]
+    started = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=profile["dpi"], first_page=first_page, last_page=last_page)
+    render_seconds = (time.perf_counter() - started) / max(len(images), 1)
+
+    pages = []
+    for offset, image in enumerate(images):
+        page_number = first_page + offset
+        page_type = classify_page(page_number, page_texts[page_number], image) \
+            if page_texts and page_number in page_texts else "unknown"
+        started = time.perf_counter()
+        jpeg_bytes = encode_page(image, profile)
+        metadata = {
+            'page-type': page_type,
+            'width': str(image.width),
+            'height': str(image.height),
+            'dpi': str(profile["dpi"]),
+            'profile': profile_name,
+            'size-bytes': str(len(jpeg_bytes))
+        }
+        image.close()
+        pages.append((page_number, jpeg_bytes, metadata, render_seconds, time.perf_counter() - started))
+    return pages
+
+def upload_page(jpeg_bytes, s3_key, metadata, in_flight, cache_key=None):
+    started = time.perf_counter()
+    try:
+        if upload_to_s3(jpeg_bytes, s3_key, metadata) and cache_key:
+            copy_in_s3(s3_key, cache_key)
+    finally:
+        in_flight.release()
+    return time.perf_counter() - started
+
+def convert_pdf_parallel(pdf_path, s3_output_prefix, first_page, last_page, cache_prefix=None, page_texts=None):
+    """
+    Renders page windows on RENDER_WORKERS threads (each one a separate poppler process)
+    while UPLOAD_WORKERS threads upload finished pages. A semaphore caps how many pages
+    are rendering or waiting for upload, so uploads overlap rendering without encoded
+    pages piling up in memory.
+    Each uploaded page is also copied into cache_prefix (server-side) when given.
+    Returns the timing report for pages first_page..last_page.
+    """
+    started = time.perf_counter()
+    in_flight = threading.Semaphore(MAX_IN_FLIGHT_PAGES)
+    report = {"pages": last_page - first_page + 1, "render_s": 0.0, "encode_s": 0.0, "upload_s": 0.0,
+              "page_types": {}}
+    upload_futures = []
+
+    with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as render_pool, \
+            ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as upload_pool:
+
+        def render_and_queue(first_page, last_page):
+            slots = last_page - first_page + 1
+            try:
+                pages = render_window(pdf_path, first_page, last_page, page_texts)
+            except Exception:
+                for _ in range(slots):
+                    in_flight.release()
+                raise
+            for _ in range(slots - len(pages)):
+                in_flight.release()
+            timings = []
+            for page_number, jpeg_bytes, metadata, render_s, encode_s in pages:
+                s3_key = f"{s3_output_prefix}page_{page_number}.jpg"
+                cache_key = f"{cache_prefix}page_{page_number}.jpg" if cache_prefix else None
+                upload_futures.append(
+                    upload_pool.submit(upload_page, jpeg_bytes, s3_key, metadata, in_flight, cache_key))
+                timings.append((render_s, encode_s, metadata['page-type']))
+            return timings
+
+        render_futures = []
+        for window_first, window_last in plan_page_ranges(first_page, last_page, RENDER_WINDOW):
+            for _ in range(window_last - window_first + 1):
+                in_flight.acquire()
+            render_futures.append(render_pool.submit(render_and_queue, window_first, window_last))
+
+        for future in render_futures:
+            for render_s, encode_s, page_type in future.result():
+                report["render_s"] += render_s
+                report["encode_s"] += encode_s
+                report["page_types"][page_type] = report["page_types"].get(page_type, 0) + 1
+
+    # Both pools have shut down, so every upload has been queued and finished
+    for future in upload_futures:
+        report["upload_s"] += future.result()
+
+    report["wall_s"] = time.perf_counter() - started
+    return report
+
+def plan_page_ranges(first_page, last_page, pages_per_range):
+    return [
+        (start, min(start + pages_per_range - 1, last_page))
+        for start in range(first_page, last_page + 1, pages_per_range)
+    ]
+
+def trigger_render_worker(s3_key, first_page, last_page, digest=None):
+    """
+    Invokes this function asynchronously to render one page range of the PDF.
+    """
+    payload = {
+        'render_job': {
+            's3_key': s3_key,
+            'first_page': first_page,
+            'last_page': last_page,
+            'digest': digest
+        }
+    }
+    print(f"Fanning out pages {first_page}-{last_page} of {s3_key}")
+    lambda_client.invoke(
+        FunctionName=os.environ.get('AWS_LAMBDA_FUNCTION_NAME'),
+        InvocationType='Event',
+        Payload=json.dumps(payload)
+    )
 
-def process_pdf(s3_key):
+def process_pdf(s3_key, first_page=1, last_page=None, fan_out=False, digest=None, context=None):
+    """
+    Renders pages first_page..last_page (default: all) of the PDF.
+    If the render cache already holds those pages for this PDF's content hash and the
+    active profile, they are copied to the output path instead of rendered.
+    With fan_out and SPLIT_MODE on, acts as the planner: the page count is split into
+    SPLIT_PAGES_PER_WORKER ranges, every range but the first goes to a separate
+    invocation, and this invocation renders the first range itself. The planner also
+    claims the digest, so concurrent uploads of the same PDF render it only once.
+    """
     # s3_key example: data/raw/PnP/Gauteng/Weekly_Specials.pdf
     filename = os.path.basename(s3_key)
     flyer_name = os.path.splitext(filename)[0]
@@ -35,9 +458,24 @@ def process_pdf(s3_key):
         province = "unknown"
 
     local_pdf_path = f"/tmp/{filename}"
-    output_base_dir = f"/tmp/images/{province}/{flyer_name}"
-    os.makedirs(output_base_dir, exist_ok=True)
+    # S3 Output Key: data/interim/images/PnP/{province}/{flyer_name}/page_{n}.jpg
+    s3_output_prefix = f"data/interim/images/PnP/{province}/{flyer_name}/"
 
+    digest = digest or get_pdf_digest(s3_key)
+    if digest:
+        cache_prefix = render_cache_prefix(digest)
+        page_count, cached_pages = load_render_cache(cache_prefix)
+        if page_count:
+            wanted_last = min(last_page or page_count, page_count)
+            if set(range(first_page, wanted_last + 1)) <= cached_pages:
+                report = copy_cached_pages(cache_prefix, s3_output_prefix, first_page, wanted_last)
+                print(f"♻️ {filename} pages {first_page}-{wanted_last}: render cache hit "
+                      f"({report['cache_hits']} pages copied in {report['wall_s']:.1f}s)")
+                return report
+        if fan_out and not claim_render(cache_prefix, s3_key):
+            return await_render(cache_prefix, s3_key, s3_output_prefix, digest, context)
+
+    claimed = bool(digest) and fan_out
     print(f"Downloading {s3_key} from {S3_BUCKET}...")
     try:
         s3_client.download_file(S3_BUCKET, s3_key, local_pdf_path)
@@ -48,30 +486,59 @@ def process_pdf(s3_key):
     try:
         # Convert PDF to High-Res JPEG (300 DPI for AI clarity)
         # Note: poppler must be in the PATH (e.g., via Lambda Layer)
-        images = convert_from_path(local_pdf_path, dpi=300)
-        
-        for i, image in enumerate(images):
-            image_filename = f"page_{i + 1}.jpg"
-            local_image_path = os.path.join(output_base_dir, image_filename)
-            image.save(local_image_path, "JPEG")
-            
-            # S3 Output Key: data/interim/images/PnP/{province}/{flyer_name}/page_{i+1}.jpg
-            s3_output_key = f"data/interim/images/PnP/{province}/{flyer_name}/{image_filename}"
-            upload_to_s3(local_image_path, s3_output_key)
-            
-            # Clean up local image
-            os.remove(local_image_path)
+        digest = digest or sha256_file(local_pdf_path)
+        cache_prefix = render_cache_prefix(digest)
+        if fan_out and not claimed:
+            # Older objects have no sha256 metadata, so the claim waits for the download
+            if not claim_render(cache_prefix, s3_key):
+                return await_render(cache_prefix, s3_key, s3_output_prefix, digest, context)
+            claimed = True
+        page_count = pdfinfo_from_path(local_pdf_path)["Pages"]
+        last_page = min(last_page or page_count, page_count)
+        if first_page == 1:
+            # Written by the planner (or a whole-PDF run) so later hits know the page count
+            save_render_cache_manifest(cache_prefix, page_count)
+
+        if fan_out and SPLIT_MODE and last_page - first_page + 1 > SPLIT_PAGES_PER_WORKER:
+            ranges = plan_page_ranges(first_page, last_page, SPLIT_PAGES_PER_WORKER)
+            for range_first, range_last in ranges[1:]:
+                trigger_render_worker(s3_key, range_first, range_last, digest)
+            first_page, last_page = ranges[0]
+
+        page_texts = extract_page_texts(local_pdf_path, first_page, last_page)
+        report = convert_pdf_parallel(
+            local_pdf_path, s3_output_prefix, first_page, last_page, cache_prefix, page_texts)
+        print(
+            f"⏱️ {filename} pages {first_page}-{last_page}: {report['pages']} pages in {report['wall_s']:.1f}s wall "
+            f"(render {report['render_s']:.1f}s, encode {report['encode_s']:.1f}s, "
+            f"upload {report['upload_s']:.1f}s across workers), page types {report['page_types']}"
+        )
+        return report
             
     except Exception as e:
         print(f"Error converting {filename}: {e}")
+        if fan_out and claimed:
+            release_render_claim(cache_prefix)
     finally:
         if os.path.exists(local_pdf_path):
             os.remove(local_pdf_path)
 
 def lambda_handler(event, context):
     """
-    Triggered by S3 ObjectCreated events.
+    Triggered by S3 ObjectCreated events, or by the planner with a render_job page range.
     """
+    if 'render_job' in event:
+        job = event['render_job']
+        print(f"Rendering pages {job['first_page']}-{job['last_page']} of {job['s3_key']}")
+        process_pdf(job['s3_key'], job['first_page'], job['last_page'], digest=job.get('digest'))
+        return {'statusCode': 200, 'body': json.dumps('Page range processing complete')}
+
+    if 'await_render' in event:
+        # Another invocation holds the render claim for this PDF; keep copying from the cache
+        job = event['await_render']
+        process_pdf(job['s3_key'], fan_out=True, digest=job.get('digest'), context=context)
+        return {'statusCode': 200, 'body': json.dumps('Shared render processing complete')}
+
     for record in event.get('Records', []):
         bucket = record['s3']['bucket']['name']
         key = record['s3']['object']['key']
@@ -79,7 +546,7 @@ def lambda_handler(event, context):
         # Only process PDFs in the raw directory
         if key.endswith('.pdf') and 'data/raw/PnP/' in key:
             print(f"Processing new PDF: {key}")
-            process_pdf(key)
+            process_pdf(key, fan_out=True, context=context)
             
     return {
         'statusCode': 200,
@@ -0,0 +1,158 @@
+import sys
+import json
+import time
+import argparse
+import importlib.util
+from pathlib import Path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from google.genai import types
+
+from gen_pdf_img import RENDER_PROFILES, BRONZE_DIR, PROJECT_ROOT, encode_page
+
+# Compares rendering profiles on real flyers: bytes per page, render/encode time,
+# Gemini latency and input tokens, and how well each profile's extraction agrees
+# with the reference profile (the first one listed).
+#
+# python3 scripts/pdfscr/pdf-img/render_profile_bench.py --pages 3 data/raw/PnP/Gauteng/*.pdf
+
+# WebP cannot feed the pipeline (everything downstream keys on page_N.jpg), but it is
+# worth knowing what it would save, so the benchmark tries it alongside the real profiles.
+BENCH_PROFILES = dict(RENDER_PROFILES, **{
+    "vision-webp": {"dpi": 200, "max_long_edge": 3072, "format": "WEBP", "quality": 80, "progressive": False},
+})
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+RESULTS_PATH = PROJECT_ROOT / "data" / "bench" / "render_profiles.json"
+
+def load_vision_parser():
+    # Reuse the local parser's client and SYSTEM_INSTRUCTION so we benchmark the real prompt
+    parser_path = Path(__file__).resolve().parents[1] / "img-json" / "pnp-vision-parser.py"
+    spec = importlib.util.spec_from_file_location("pnp_vision_parser", parser_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def product_keys(products):
+    keys = set()
+    for product in products if isinstance(products, list) else []:
+        if not isinstance(product, dict):
+            continue
+        name = " ".join(str(product.get("product_name") or "").lower().split())
+        try:
+            price = round(float(product.get("current_price")), 2)
+        except (TypeError, ValueError):
+            price = None
+        keys.add((name, price))
+    return keys
+
+def agreement(reference, candidate):
+    # F1 over (product_name, current_price) pairs
+    if not reference and not candidate:
+        return 1.0
+    matched = len(reference & candidate)
+    if matched == 0:
+        return 0.0
+    precision = matched / len(candidate)
+    recall = matched / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+def parse_page(parser, model_id, image_bytes, mime_type):
+    started = time.perf_counter()
+    response = parser.client.models.generate_content(
+        model=model_id,
+        contents=[
+            types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
+            "Extract grocery data according to system instructions."
+        ],
+        config=types.GenerateContentConfig(
+            system_instruction=parser.SYSTEM_INSTRUCTION,
+            response_mime_type="application/json"
+        )
+    )
+    latency = time.perf_counter() - started
+    try:
+        products = json.loads(response.text) if response.text else []
+    except json.JSONDecodeError:
+        products = []
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", None) or 0
+    return products, latency, input_tokens
+
+def run_benchmark(pdf_paths, profile_names, max_pages, model_id):
+    parser = load_vision_parser()
+    totals = {name: {"pages": 0, "bytes": 0, "render_s": 0.0, "parse_s": 0.0,
+                     "input_tokens": 0, "products": 0, "agreement": 0.0} for name in profile_names}
+    reference_name = profile_names[0]
+
+    for pdf_path in pdf_paths:
+        page_count = min(pdfinfo_from_path(str(pdf_path))["Pages"], max_pages)
+        print(f"\n📄 {pdf_path} ({page_count} pages)")
+        for page_number in range(1, page_count + 1):
+            reference_keys = None
+            for name in profile_names:
+                profile = BENCH_PROFILES[name]
+                started = time.perf_counter()
+                image = convert_from_path(str(pdf_path), dpi=profile["dpi"],
+                                          first_page=page_number, last_page=page_number)[0]
+                image_bytes = encode_page(image, profile)
+                image.close()
+                render_s = time.perf_counter() - started
+
+                try:
+                    products, parse_s, input_tokens = parse_page(
+                        parser, model_id, image_bytes, MIME_TYPES[profile["format"]])
+                except Exception as e:
+                    print(f"  ❌ page {page_number} [{name}]: {e}")
+                    continue
+
+                keys = product_keys(products)
+                if name == reference_name:
+                    reference_keys = keys
+                score = agreement(reference_keys, keys) if reference_keys is not None else 0.0
+
+                stats = totals[name]
+                stats["pages"] += 1
+                stats["bytes"] += len(image_bytes)
+                stats["render_s"] += render_s
+                stats["parse_s"] += parse_s
+                stats["input_tokens"] += input_tokens
+                stats["products"] += len(keys)
+                stats["agreement"] += score
+                print(f"  page {page_number} [{name}]: {len(image_bytes) / 1e6:.2f} MB, "
+                      f"{parse_s:.1f}s, {len(keys)} products, agreement {score:.2f}")
+    return totals
+
+def print_report(totals):
+    print(f"\n{'profile':<14}{'MB/page':>9}{'render s':>10}{'parse s':>9}{'tokens':>9}{'products':>10}{'agree':>8}")
+    for name, stats in totals.items():
+        pages = stats["pages"] or 1
+        print(f"{name:<14}{stats['bytes'] / pages / 1e6:>9.2f}{stats['render_s'] / pages:>10.2f}"
+              f"{stats['parse_s'] / pages:>9.2f}{stats['input_tokens'] / pages:>9.0f}"
+              f"{stats['products'] / pages:>10.1f}{stats['agreement'] / pages:>8.2f}")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark rendering profiles against the vision parser.")
+    arg_parser.add_argument("pdfs", nargs="*", type=Path, help="Flyer PDFs (default: every PDF under data/raw/PnP)")
+    arg_parser.add_argument("--profiles", default=",".join(BENCH_PROFILES),
+                            help="Comma separated profile names, the first is the reference")
+    arg_parser.add_argument("--pages", type=int, default=3, help="Pages per flyer to compare")
+    arg_parser.add_argument("--model", default="gemini-2.5-flash-lite")
+    args = arg_parser.parse_args()
+
+    pdf_paths = args.pdfs or sorted(BRONZE_DIR.glob("*/*.pdf"))
+    profile_names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    unknown = [name for name in profile_names if name not in BENCH_PROFILES]
+    if unknown or not pdf_paths:
+        print(f"❌ Unknown profiles {unknown}" if unknown else f"❌ No PDFs found under {BRONZE_DIR}")
+        sys.exit(1)
+
+    totals = run_benchmark(pdf_paths, profile_names, args.pages, args.model)
+    print_report(totals)
+
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_PATH, "w") as f:
+        json.dump({"model": args.model, "profiles": {n: BENCH_PROFILES[n] for n in profile_names},
+                   "totals": totals}, f, indent=4)
+    print(f"\n📊 Results saved to {RESULTS_PATH}")
+
+if __name__ == "__main__":
+    main()
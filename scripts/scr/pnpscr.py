@@ -1,11 +1,126 @@
 import os
+import shutil
+import hashlib
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from playwright.sync_api import sync_playwright
 from playwright_stealth import Stealth
 
 # Configuration
 BASE_URL = "https://www.pnp.co.za/catalogues"
 ROOT_DIR = "data/raw/PnP"
+# Content-addressed store: one file per unique PDF, province paths are hard links to it
+BLOB_DIR = "data/raw/blobs/PnP"
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
+
+_thread_local = threading.local()
+
+# Reads every catalogue block in one page.evaluate round trip
+EXTRACT_CATALOGUES_JS = """
+() => Array.from(document.querySelectorAll('div.pdfdownload')).map(container => {
+    const parent = container.closest('.content');
+    const dateElement = parent ? parent.querySelector('.cat-validity-date') : null;
+    return {
+        date_text: dateElement ? dateElement.innerText.trim() : 'unknown_date',
+        links: Array.from(container.querySelectorAll('a')).map(a => [a.innerText, a.getAttribute('href')])
+    };
+})
+"""
+
+def get_session():
+    # One session per worker thread, requests.Session is not thread-safe
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        # Add a basic UA to the session to look less like a script
+        session.headers.update({"User-Agent": USER_AGENT})
+        _thread_local.session = session
+    return session
+
+def link_local(src_path, dst_path):
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+def store_blob(file_path, digest):
+    # Move the download into the blob store (or drop it if the blob exists) and link it back
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    blob_path = os.path.join(BLOB_DIR, f"{digest}.pdf")
+    if os.path.exists(blob_path):
+        print(f"Blob {digest[:12]} already stored, reusing it.")
+        os.remove(file_path)
+    else:
+        os.replace(file_path, blob_path)
+    link_local(blob_path, file_path)
+    return blob_path
+
+def stream_to_file(href, file_path):
+    # Stream the body to disk in chunks rather than holding the whole PDF in memory,
+    # hashing it on the way so identical flyers can share one blob
+    part_path = f"{file_path}.part"
+    digest = hashlib.sha256()
+    try:
+        with get_session().get(href, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+        os.replace(part_path, file_path)
+        return digest.hexdigest()
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def download_href(href, targets):
+    # Download the URL once, then link it to every other province that links to it
+    province, date_text, first_path = targets[0]
+    try:
+        print(f"Downloading {province} ({date_text}) from {href}...")
+        digest = stream_to_file(href, first_path)
+        blob_path = store_blob(first_path, digest)
+        print(f"Successfully saved to {first_path} (sha256 {digest[:12]})")
+    except Exception as e:
+        print(f"Failed to download {province}: {e}")
+        return
+
+    for province, date_text, file_path in targets[1:]:
+        print(f"Linking {province} to already downloaded file for {href}")
+        link_local(blob_path, file_path)
+
+def download_catalogue_files(catalogues):
+    # catalogues: list of (province, date_text, date_slug, href)
+    pending = {}
+    queued_paths = set()
+    for province, date_text, date_slug, href in catalogues:
+        target_dir = os.path.join(ROOT_DIR, province)
+        os.makedirs(target_dir, exist_ok=True)
+        file_path = os.path.join(target_dir, f"{date_slug}.pdf")
+
+        if file_path in queued_paths:
+            continue
+
+        if os.path.exists(file_path):
+            print(f"Skipping {province} ({date_text}) - already exists.")
+            continue
+
+        queued_paths.add(file_path)
+        pending.setdefault(href, []).append((province, date_text, file_path))
+
+    if not pending:
+        print("No new catalogues to download.")
+        return
+
+    print(f"Downloading {len(pending)} unique catalogues with {DOWNLOAD_WORKERS} workers...")
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        list(executor.map(lambda item: download_href(*item), pending.items()))
 
 def download_catalogues():
     with sync_playwright() as p:
@@ -39,64 +154,26 @@ def download_catalogues():
                 context.close()
                 return
 
-        download_containers = page.query_selector_all("div.pdfdownload")
-        print(f"Found {len(download_containers)} download containers.")
+        blocks = page.evaluate(EXTRACT_CATALOGUES_JS)
+        print(f"Found {len(blocks)} download containers.")
 
-        # Dictionary to store url -> local_path mapping to avoid redundant downloads
-        url_to_path = {}
-        session = requests.Session()
-        # Add a basic UA to the session to look less like a script
-        session.headers.update({
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
-        })
-
-        for container in download_containers:
-            parent = container.evaluate_handle("el => el.closest('.content')")
-            date_element = parent.query_selector(".cat-validity-date")
-            date_text = date_element.inner_text().strip() if date_element else "unknown_date"
-            
+        catalogues = []
+        for block in blocks:
+            date_text = block["date_text"]
             # Remove "Valid " prefix if present to keep filenames clean
             clean_date_text = date_text.replace("Valid", "").strip()
             date_slug = "".join([c if c.isalnum() or c in ("_", "-") else "_" for c in clean_date_text])
 
-            links = container.query_selector_all("a")
-            for link in links:
-                province = link.inner_text().strip().replace(" ", "_")
-                href = link.get_attribute("href")
-                
+            for link_text, href in block["links"]:
+                province = link_text.strip().replace(" ", "_")
                 if not href or ".pdf" not in href.lower() or "Shop_now" in province:
                     continue
 
-                target_dir = os.path.join(ROOT_DIR, province)
-                os.makedirs(target_dir, exist_ok=True)
-                file_path = os.path.join(target_dir, f"{date_slug}.pdf")
-
-                if os.path.exists(file_path):
-                    print(f"Skipping {province} ({date_text}) - already exists.")
-                    continue
-
-                # If we already downloaded this URL in this run, just copy/link it
-                if href in url_to_path:
-                    print(f"Linking {province} to already downloaded file for {href}")
-                    with open(url_to_path[href], 'rb') as f_src:
-                        with open(file_path, 'wb') as f_dst:
-                            f_dst.write(f_src.read())
-                    continue
-
-                try:
-                    print(f"Downloading {province} ({date_text}) from {href}...")
-                    response = session.get(href, timeout=30)
-                    response.raise_for_status()
-                    
-                    with open(file_path, "wb") as f:
-                        f.write(response.content)
-                    
-                    url_to_path[href] = file_path
-                    print(f"Successfully saved to {file_path}")
-                except Exception as e:
-                    print(f"Failed to download {province}: {e}")
+                catalogues.append((province, date_text, date_slug, href))
 
         context.close()
 
+    download_catalogue_files(catalogues)
+
 if __name__ == "__main__":
     download_catalogues()
\ No newline at end of file
@@ -1,15 +1,22 @@
 import os
 import json
+import shutil
+import hashlib
+import time
+import threading
 import requests
 import boto3
-from playwright.sync_api import sync_playwright
-from playwright_stealth import Stealth
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
 from botocore.exceptions import ClientError
 
 # Configuration for AWS Lambda
 BASE_URL = "https://www.pnp.co.za/catalogues"
 ROOT_DIR = "/tmp/data/raw/PnP"
 USER_DATA_DIR = "/tmp/user_data"
+# Try a plain HTTP fetch + HTML parse before paying for a Chromium launch
+FAST_DISCOVERY = os.environ.get("FAST_DISCOVERY", "true").lower() == "true"
 
 # Ensure Playwright finds the browser in the right path inside the container
 os.environ["PLAYWRIGHT_BROWSERS_PATH"] = "/ms-playwright"
@@ -17,12 +24,109 @@ os.environ["PLAYWRIGHT_BROWSERS_PATH"] = "/ms-playwright"
 # S3 Configuration from environment variables
 S3_BUCKET = os.environ.get("S3_BUCKET_NAME")
 S3_PREFIX = "data/raw/PnP/"
+# Content-addressed store: one blob per unique PDF, province keys are server-side copies of it.
+# Kept outside data/raw/PnP/ so storing a blob never triggers the converter.
+BLOB_PREFIX = "data/raw/blobs/PnP/"
+# Existence index: one paginated listing per prefix replaces a HEAD per key.
+# Optionally persisted so the next run loads one object instead of listing the prefix.
+# A manifest is only trusted for EXISTENCE_MANIFEST_MAX_AGE_SECONDS after the listing it
+# came from (less than one daily run), so keys deleted since then are picked up again.
+EXISTENCE_MANIFEST_PREFIX = "data/manifests/existence/"
+USE_EXISTENCE_MANIFEST = os.environ.get("USE_EXISTENCE_MANIFEST", "false").lower() == "true"
+EXISTENCE_MANIFEST_MAX_AGE_SECONDS = int(os.environ.get("EXISTENCE_MANIFEST_MAX_AGE_SECONDS", "72000"))
+# HTTP validator cache: href -> {etag, last_modified, content_length, sha256}, persisted between runs
+HTTP_CACHE_KEY = "data/manifests/http_cache/PnP_catalogues.json"
+
+# Download stage: bounded concurrency, bodies are streamed to disk in chunks
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
 
 s3_client = boto3.client('s3')
+_thread_local = threading.local()
+_existing_keys = {}  # prefix -> set of keys, rebuilt once per invocation
+_listed_at = {}  # prefix -> when the keys in _existing_keys were listed
+_http_cache = {}
+
+def existence_manifest_key(prefix):
+    return f"{EXISTENCE_MANIFEST_PREFIX}{prefix.strip('/').replace('/', '_')}.json"
+
+def load_existence_manifest(prefix):
+    """
+    Returns (listed_at, keys) from the persisted manifest, or (None, None) when there is
+    none or it is older than EXISTENCE_MANIFEST_MAX_AGE_SECONDS.
+    """
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=existence_manifest_key(prefix))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        return None, None
+    manifest = json.loads(response['Body'].read())
+    # Manifests written before listed_at existed can't be aged, so they are never trusted
+    listed_at = manifest.get("listed_at") if isinstance(manifest, dict) else None
+    if listed_at is None or time.time() - listed_at > EXISTENCE_MANIFEST_MAX_AGE_SECONDS:
+        return None, None
+    return listed_at, set(manifest["keys"])
+
+def build_existence_index(prefix):
+    """
+    Lists every key under the prefix once and keeps it as an in-memory set,
+    so skip checks for that prefix never touch the network again.
+    """
+    keys = set()
+    if S3_BUCKET and USE_EXISTENCE_MANIFEST:
+        listed_at, manifest_keys = load_existence_manifest(prefix)
+        if manifest_keys is not None:
+            _existing_keys[prefix] = manifest_keys
+            _listed_at[prefix] = listed_at
+            print(f"Loaded existence manifest for {prefix} ({len(manifest_keys)} keys, {time.time() - listed_at:.0f}s old)")
+            return manifest_keys
+    listed_at = time.time()
+    if S3_BUCKET:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                keys.add(obj['Key'])
+    _existing_keys[prefix] = keys
+    _listed_at[prefix] = listed_at
+    print(f"Indexed {len(keys)} existing keys under {prefix}")
+    return keys
+
+def save_existence_manifest(prefix):
+    """
+    Persists the index, merged with whatever another invocation saved meanwhile. The
+    merged manifest keeps the older listing time, so it expires with its oldest part.
+    """
+    if not (S3_BUCKET and USE_EXISTENCE_MANIFEST) or prefix not in _existing_keys:
+        return
+    try:
+        keys, listed_at = set(_existing_keys[prefix]), _listed_at[prefix]
+        other_listed_at, other_keys = load_existence_manifest(prefix)
+        if other_keys is not None:
+            keys |= other_keys
+            listed_at = min(listed_at, other_listed_at)
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=existence_manifest_key(prefix),
+            Body=json.dumps({"listed_at": listed_at, "keys": sorted(keys)}),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Failed to save existence manifest for {prefix}: {e}")
+
+def mark_exists(s3_key):
+    for prefix, keys in _existing_keys.items():
+        if s3_key.startswith(prefix):
+            keys.add(s3_key)
 
 def file_exists_in_s3(s3_key):
     if not S3_BUCKET:
         return False
+    for prefix, keys in _existing_keys.items():
+        if s3_key.startswith(prefix):
+            return s3_key in keys
+    # Key is not covered by an index, fall back to a single HEAD
     try:
         s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
         return True
@@ -37,15 +141,387 @@ def upload_to_s3(local_path, s3_key):
         return
     try:
         s3_client.upload_file(local_path, S3_BUCKET, s3_key)
+        mark_exists(s3_key)
         print(f"Successfully uploaded {local_path} to s3://{S3_BUCKET}/{s3_key}")
     except Exception as e:
         print(f"Failed to upload to S3: {e}")
 
-def download_catalogues():
-    # Ensure directories exist in /tmp
-    os.makedirs(ROOT_DIR, exist_ok=True)
+def sha256_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_local(src_path, dst_path):
+    # Hard link where possible so duplicate provinces cost no extra /tmp space
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+def store_blob(local_path, digest):
+    """
+    Uploads the PDF to the content-addressed store unless a blob with the same hash exists.
+    Returns the blob key.
+    """
+    blob_key = f"{BLOB_PREFIX}{digest}.pdf"
+    if file_exists_in_s3(blob_key):
+        print(f"Blob {digest[:12]} already stored, reusing it.")
+        return blob_key
+    upload_to_s3(local_path, blob_key)
+    return blob_key
+
+def link_to_blob(blob_key, s3_key, digest, href):
+    """
+    Points a province key at a blob with a server-side copy (no bytes pass through Lambda).
+    The sha256 metadata lets later stages recognise identical flyers across provinces.
+    """
+    if not S3_BUCKET:
+        print(f"S3_BUCKET_NAME not set, skipping link of {s3_key}")
+        return
+    try:
+        s3_client.copy_object(
+            Bucket=S3_BUCKET,
+            Key=s3_key,
+            CopySource={'Bucket': S3_BUCKET, 'Key': blob_key},
+            MetadataDirective='REPLACE',
+            ContentType='application/pdf',
+            Metadata={'sha256': digest, 'source-url': href}
+        )
+        mark_exists(s3_key)
+        print(f"Linked s3://{S3_BUCKET}/{s3_key} -> {blob_key}")
+    except Exception as e:
+        print(f"Failed to link {s3_key} to blob: {e}")
+
+def publish_catalogue(local_path, digest, href, targets, unchanged=False):
+    """
+    Stores the PDF once as a blob and points every province key at it.
+    targets: list of (province, date_text, file_path, s3_key)
+    unchanged: the href still serves the cached content, so keys that already exist are
+    left alone (re-copying them would re-trigger the whole pipeline). local_path may be
+    None when the server answered 304 and the blob is already stored.
+    """
+    blob_key = store_blob(local_path, digest) if local_path else f"{BLOB_PREFIX}{digest}.pdf"
+    for province, date_text, file_path, s3_key in targets:
+        if unchanged and file_exists_in_s3(s3_key):
+            print(f"Skipping {province} ({date_text}) - unchanged since last scrape.")
+            continue
+        if local_path and file_path != local_path:
+            link_local(local_path, file_path)
+        link_to_blob(blob_key, s3_key, digest, href)
+
+def load_http_cache():
+    _http_cache.clear()
+    if not S3_BUCKET:
+        return
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET, Key=HTTP_CACHE_KEY)
+        _http_cache.update(json.loads(response['Body'].read()))
+        print(f"Loaded HTTP validators for {len(_http_cache)} catalogue URLs")
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+
+def save_http_cache():
+    if not S3_BUCKET:
+        return
+    try:
+        s3_client.put_object(
+            Bucket=S3_BUCKET,
+            Key=HTTP_CACHE_KEY,
+            Body=json.dumps(_http_cache, indent=4),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Failed to save HTTP cache: {e}")
+
+def conditional_headers(cached):
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+def validators_match(cached, response_headers):
+    """
+    Fallback for servers that ignore conditional requests: the headers of a 200
+    are enough to tell the body is the one we already have.
+    """
+    etag = response_headers.get("ETag")
+    if etag and cached.get("etag"):
+        return etag == cached["etag"]
+    last_modified = response_headers.get("Last-Modified")
+    length = response_headers.get("Content-Length")
+    return bool(last_modified and length) and \
+        last_modified == cached.get("last_modified") and length == cached.get("content_length")
+
+def get_session():
+    # requests.Session is not thread-safe, so each download worker keeps its own
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+        _thread_local.session = session
+    return session
+
+def stream_to_file(href, file_path, cached=None):
+    """
+    Streams the response body to disk chunk by chunk instead of buffering it in memory.
+    Writes to a .part file first so a failed download never looks like a finished one.
+    Returns (sha256, validators), or (None, None) when the cached entry is still current
+    and no body was read.
+    """
+    cached = cached or {}
+    part_path = f"{file_path}.part"
+    digest = hashlib.sha256()
+    try:
+        with get_session().get(href, stream=True, timeout=30, headers=conditional_headers(cached)) as response:
+            if response.status_code == 304:
+                return None, None
+            response.raise_for_status()
+            if cached and validators_match(cached, response.headers):
+                return None, None
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_length": response.headers.get("Content-Length"),
+            }
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+        os.replace(part_path, file_path)
+        return digest.hexdigest(), validators
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def download_href(href, targets):
+    """
+    Downloads one catalogue URL once and fans it out to every province that links to it.
+    targets: list of (province, date_text, file_path, s3_key)
+    """
+    province, date_text, first_path, first_key = targets[0]
+    cached = _http_cache.get(href, {})
+    # Only trust validators while the blob they describe is still stored
+    if cached and not file_exists_in_s3(f"{BLOB_PREFIX}{cached.get('sha256')}.pdf"):
+        cached = {}
+    try:
+        print(f"Downloading {province} ({date_text}) from {href}...")
+        digest, validators = stream_to_file(href, first_path, cached)
+    except Exception as e:
+        print(f"Failed to download {province}: {e}")
+        return
+
+    if digest is None:
+        print(f"Not modified: {href} (sha256 {cached['sha256'][:12]})")
+        publish_catalogue(None, cached["sha256"], href, targets, unchanged=True)
+        return
+
+    print(f"Successfully saved to {first_path} (sha256 {digest[:12]})")
+    _http_cache[href] = dict(validators, sha256=digest)
+    publish_catalogue(first_path, digest, href, targets, unchanged=digest == cached.get("sha256"))
+
+def download_catalogue_files(catalogues):
+    """
+    Download stage. catalogues: list of (province, date_text, date_slug, href).
+    Each distinct href is fetched once; downloads and uploads overlap across provinces.
+    """
+    for prefix in (S3_PREFIX, BLOB_PREFIX):
+        build_existence_index(prefix)
+    load_http_cache()
+
+    pending = {}
+    queued_keys = set()
+    for province, date_text, date_slug, href in catalogues:
+        s3_key = f"{S3_PREFIX}{province}/{date_slug}.pdf"
+        if s3_key in queued_keys:
+            continue
+        target_dir = os.path.join(ROOT_DIR, province)
+        os.makedirs(target_dir, exist_ok=True)
+        file_path = os.path.join(target_dir, f"{date_slug}.pdf")
+
+        # An unknown_date key never changes name, so it is always revalidated against
+        # the server (a conditional request) instead of being skipped forever
+        revalidate = date_slug == "unknown_date"
+
+        if not revalidate and file_exists_in_s3(s3_key):
+            print(f"Skipping {province} ({date_text}) - already exists in S3.")
+            continue
+
+        if not revalidate and os.path.exists(file_path):
+            print(f"Skipping {province} ({date_text}) - already exists locally.")
+            publish_catalogue(file_path, sha256_file(file_path), href, [(province, date_text, file_path, s3_key)])
+            continue
+
+        queued_keys.add(s3_key)
+        pending.setdefault(href, []).append((province, date_text, file_path, s3_key))
+
+    if pending:
+        print(f"Downloading {len(pending)} unique catalogues with {DOWNLOAD_WORKERS} workers...")
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            # list() surfaces any unexpected worker exception here
+            list(executor.map(lambda item: download_href(*item), pending.items()))
+    else:
+        print("No new catalogues to download.")
+
+    save_http_cache()
+    for prefix in (S3_PREFIX, BLOB_PREFIX):
+        save_existence_manifest(prefix)
+
+# Runs inside the page: reads every catalogue block in one round trip instead of
+# a Playwright call per element. Mirrors extract_catalogue_blocks_from_html().
+EXTRACT_CATALOGUES_JS = """
+() => Array.from(document.querySelectorAll('div.pdfdownload')).map(container => {
+    const parent = container.closest('.content');
+    const dateElement = parent ? parent.querySelector('.cat-validity-date') : null;
+    return {
+        date_text: dateElement ? dateElement.innerText.trim() : 'unknown_date',
+        links: Array.from(container.querySelectorAll('a')).map(a => [a.innerText, a.getAttribute('href')])
+    };
+})
+"""
+
+def catalogue_entries(date_text, links):
+    """
+    Turns one catalogue block into (province, date_text, date_slug, href) tuples.
+    links: list of (link_text, href) from the block's div.pdfdownload.
+    """
+    clean_date_text = date_text.replace("Valid", "").strip()
+    date_slug = "".join([c if c.isalnum() or c in ("_", "-") else "_" for c in clean_date_text])
+
+    entries = []
+    for link_text, href in links:
+        province = link_text.strip().replace(" ", "_")
+        if not href or ".pdf" not in href.lower() or "Shop_now" in province:
+            continue
+        entries.append((province, date_text, date_slug, urljoin(BASE_URL, href)))
+    return entries
+
+def catalogues_from_blocks(blocks):
+    """
+    blocks: [{"date_text": str, "links": [(link_text, href), ...]}, ...] as produced by
+    either discovery path. Returns the flat list the download stage consumes.
+    """
+    catalogues = []
+    for block in blocks:
+        catalogues.extend(catalogue_entries(block["date_text"], block["links"]))
+    return catalogues
+
+class _Node:
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.classes = (self.attrs.get("class") or "").split()
+        self.parent = parent
+        self.children = []  # _Node or str
+
+    def text(self):
+        parts = []
+        for child in self.children:
+            parts.append(child if isinstance(child, str) else child.text())
+        return " ".join(" ".join(parts).split())
+
+    def find_all(self, tag=None, cls=None):
+        for child in self.children:
+            if isinstance(child, str):
+                continue
+            if (tag is None or child.tag == tag) and (cls is None or cls in child.classes):
+                yield child
+            yield from child.find_all(tag, cls)
+
+    def closest(self, cls):
+        node = self.parent
+        while node is not None and cls not in node.classes:
+            node = node.parent
+        return node
+
+class CatalogueHTMLParser(HTMLParser):
+    """
+    Builds a minimal element tree from the catalogue page so the same
+    div.pdfdownload / .content / .cat-validity-date lookups work without a browser.
+    """
+    VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = _Node("document", [], None)
+        self._current = self.root
+
+    def handle_starttag(self, tag, attrs):
+        node = _Node(tag, attrs, self._current)
+        self._current.children.append(node)
+        if tag not in self.VOID_TAGS:
+            self._current = node
+
+    def handle_startendtag(self, tag, attrs):
+        self._current.children.append(_Node(tag, attrs, self._current))
+
+    def handle_endtag(self, tag):
+        # Tolerate unclosed tags by popping up to the matching open element
+        node = self._current
+        while node is not None and node.tag != tag:
+            node = node.parent
+        if node is not None and node.parent is not None:
+            self._current = node.parent
+
+    def handle_data(self, data):
+        if data.strip():
+            self._current.children.append(data)
+
+def extract_catalogue_blocks_from_html(html):
+    """
+    Pure function: catalogue page HTML -> the same blocks EXTRACT_CATALOGUES_JS returns.
+    """
+    parser = CatalogueHTMLParser()
+    parser.feed(html)
+    parser.close()
+
+    blocks = []
+    for container in parser.root.find_all("div", "pdfdownload"):
+        parent = container.closest("content")
+        date_element = next(parent.find_all(cls="cat-validity-date"), None) if parent else None
+        blocks.append({
+            "date_text": date_element.text() if date_element else "unknown_date",
+            "links": [(link.text(), link.attrs.get("href")) for link in container.find_all("a")]
+        })
+    return blocks
+
+def extract_catalogues_from_html(html):
+    return catalogues_from_blocks(extract_catalogue_blocks_from_html(html))
+
+def discover_catalogues_fast():
+    """
+    Fast path: one HTTP GET and an HTML parse. Returns [] when the page is
+    script-rendered or blocked so the caller can fall back to the browser.
+    """
+    print(f"Fetching {BASE_URL} without a browser...")
+    try:
+        response = get_session().get(BASE_URL, timeout=30)
+        response.raise_for_status()
+        catalogues = extract_catalogues_from_html(response.text)
+    except Exception as e:
+        print(f"Fast discovery failed: {e}")
+        return []
+    print(f"Fast discovery found {len(catalogues)} catalogue links.")
+    return catalogues
+
+def discover_catalogues_browser():
+    """
+    Slow path: renders the catalogue page in stealth Chromium.
+    Playwright is imported here so the fast path never loads it.
+    """
+    from playwright.sync_api import sync_playwright
+    from playwright_stealth import Stealth
+
     os.makedirs(USER_DATA_DIR, exist_ok=True)
 
+    catalogues = []
     with sync_playwright() as p:
         context = p.chromium.launch_persistent_context(
             user_data_dir=USER_DATA_DIR, 
@@ -80,70 +556,26 @@ def download_catalogues():
             except Exception:
                 print("Failed to find download elements.")
                 context.close()
-                return
+                return catalogues
 
-        download_containers = page.query_selector_all("div.pdfdownload")
-        print(f"Found {len(download_containers)} download containers.")
+        blocks = page.evaluate(EXTRACT_CATALOGUES_JS)
+        print(f"Found {len(blocks)} download containers.")
+        catalogues = catalogues_from_blocks(blocks)
 
-        url_to_path = {}
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
-        })
+        context.close()
 
-        for container in download_containers:
-            parent = container.evaluate_handle("el => el.closest('.content')")
-            date_element = parent.query_selector(".cat-validity-date")
-            date_text = date_element.inner_text().strip() if date_element else "unknown_date"
-            
-            clean_date_text = date_text.replace("Valid", "").strip()
-            date_slug = "".join([c if c.isalnum() or c in ("_", "-") else "_" for c in clean_date_text])
-
-            links = container.query_selector_all("a")
-            for link in links:
-                province = link.inner_text().strip().replace(" ", "_")
-                href = link.get_attribute("href")
-                
-                if not href or ".pdf" not in href.lower() or "Shop_now" in province:
-                    continue
-
-                s3_key = f"{S3_PREFIX}{province}/{date_slug}.pdf"
-                target_dir = os.path.join(ROOT_DIR, province)
-                os.makedirs(target_dir, exist_ok=True)
-                file_path = os.path.join(target_dir, f"{date_slug}.pdf")
-
-                if file_exists_in_s3(s3_key):
-                    print(f"Skipping {province} ({date_text}) - already exists in S3.")
-                    continue
-
-                if os.path.exists(file_path):
-                    print(f"Skipping {province} ({date_text}) - already exists locally.")
-                    upload_to_s3(file_path, s3_key)
-                    continue
-
-                if href in url_to_path:
-                    print(f"Linking {province} to already downloaded file for {href}")
-                    with open(url_to_path[href], 'rb') as f_src:
-                        with open(file_path, 'wb') as f_dst:
-                            f_dst.write(f_src.read())
-                    upload_to_s3(file_path, s3_key)
-                    continue
-
-                try:
-                    print(f"Downloading {province} ({date_text}) from {href}...")
-                    response = session.get(href, timeout=30)
-                    response.raise_for_status()
-                    
-                    with open(file_path, "wb") as f:
-                        f.write(response.content)
-                    
-                    url_to_path[href] = file_path
-                    print(f"Successfully saved to {file_path}")
-                    upload_to_s3(file_path, s3_key)
-                except Exception as e:
-                    print(f"Failed to download {province}: {e}")
+    return catalogues
 
-        context.close()
+def download_catalogues():
+    # Ensure directories exist in /tmp
+    os.makedirs(ROOT_DIR, exist_ok=True)
+
+    catalogues = discover_catalogues_fast() if FAST_DISCOVERY else []
+    if not catalogues:
+        print("Falling back to browser discovery...")
+        catalogues = discover_catalogues_browser()
+
+    download_catalogue_files(catalogues)
 
 def lambda_handler(event, context):
     try:
@@ -160,4 +592,11 @@ def lambda_handler(event, context):
         }
 
 if __name__ == "__main__":
-    download_catalogues()
+    import sys
+    if len(sys.argv) > 1:
+        # Offline check of the fast path against a saved copy of the catalogue page
+        with open(sys.argv[1], encoding="utf-8") as f:
+            for entry in extract_catalogues_from_html(f.read()):
+                print(entry)
+    else:
+        download_catalogues()
@@ -1,5 +1,8 @@
 #!/bin/bash
 # This script is used to sync the local data and frontend repository with the remote repository on s3
+# --delete can remove objects that a persisted existence manifest (data/manifests/existence/) still lists.
+# Manifests expire on their own (EXISTENCE_MANIFEST_MAX_AGE_SECONDS); to re-run before that, clear them:
+#   aws s3 rm s3://special-id-data-0129/data/manifests/existence/ --recursive
 aws-vault exec capaciti -- aws s3 sync $PWD s3://special-id-data-0129 \
 --exclude "infastructure/*" \
 --exclude "user_data/*" \
@@ -12,6 +15,11 @@ aws-vault exec capaciti -- aws s3 sync $PWD s3://special-id-data-0129 \
 --exclude ".gitignore" \
 --exclude ".git/*" \
 --exclude "requirements.txt" \
+--exclude "data/interim/render_cache/*" \
+--exclude "data/interim/parse_cache/*" \
+--exclude "data/interim/batch_jobs/*" \
+--exclude "data/raw/blobs/*" \
+--exclude "data/manifests/*" \
 --delete
 
 echo "Sync completed successfully!"
\ No newline at end of file
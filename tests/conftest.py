@@ -0,0 +1,25 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+@pytest.fixture
+def load_lambda(monkeypatch):
+    """
+    Imports a Lambda script by its path under infrastructure/lambda_images (the file
+    names are not importable module names). Environment overrides apply at import.
+    """
+    def load(relative_path, **env):
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "af-south-1")
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        path = REPO_ROOT / "infrastructure" / "lambda_images" / relative_path
+        spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
@@ -0,0 +1,39 @@
+from conftest import FIXTURES_DIR
+
+BASE = "https://www.pnp.co.za"
+WEEKLY = "Valid 13 Oct - 26 Oct 2026"
+
+
+def test_fast_path_extracts_catalogues_from_saved_page(load_lambda):
+    scraper = load_lambda("scraper/pnpscrLambda.py")
+    html = (FIXTURES_DIR / "pnp_catalogues.html").read_text(encoding="utf-8")
+
+    catalogues = scraper.extract_catalogues_from_html(html)
+
+    assert [(province, date_text, href) for province, date_text, _, href in catalogues] == [
+        ("Gauteng", WEEKLY, f"{BASE}/medias/Weekly-Specials-GP.pdf"),
+        ("Western_Cape", WEEKLY, "https://cdn.pnp.co.za/medias/Weekly-Specials-WC.pdf"),
+        ("KwaZulu_Natal", WEEKLY, f"{BASE}/medias/Weekly-Specials-KZN.PDF"),
+        ("National", "Valid 01 Oct - 31 Oct 2026", f"{BASE}/medias/Baby-Toddler-National.pdf"),
+        ("Free_State", "unknown_date", f"{BASE}/medias/Liquor-Deals.pdf"),
+    ]
+
+
+def test_date_slug_matches_browser_path(load_lambda):
+    scraper = load_lambda("scraper/pnpscrLambda.py")
+    html = (FIXTURES_DIR / "pnp_catalogues.html").read_text(encoding="utf-8")
+
+    slugs = {slug for _, _, slug, _ in scraper.extract_catalogues_from_html(html)}
+
+    assert slugs == {"13_Oct_-_26_Oct_2026", "01_Oct_-_31_Oct_2026", "unknown_date"}
+
+
+def test_blocks_match_page_evaluate_shape(load_lambda):
+    scraper = load_lambda("scraper/pnpscrLambda.py")
+    html = (FIXTURES_DIR / "pnp_catalogues.html").read_text(encoding="utf-8")
+
+    blocks = scraper.extract_catalogue_blocks_from_html(html)
+
+    assert [block["date_text"] for block in blocks] == [WEEKLY, "Valid 01 Oct - 31 Oct 2026", "unknown_date"]
+    assert blocks[0]["links"][3] == ("Shop now", "/c/specials")
+    assert blocks[1]["links"][2] == ("Eastern Cape", None)
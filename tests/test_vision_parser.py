@@ -0,0 +1,296 @@
+import io
+import json
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+PARSER = "vision_parser/pnp-vision-parserLambda.py"
+BUCKET = "bkt1"
+
+
+def test_queue_accepts_planner_and_s3_notification_bodies(load_lambda):
+    parser = load_lambda(PARSER)
+    notification = {"Records": [
+        {"s3": {"object": {"key": "data/interim/images/PnP/Gauteng/Weekly+Specials/page_3.jpg", "size": 2048}}},
+        {"s3": {"object": {"key": "data/interim/images/PnP/Gauteng/Weekly/pages.json", "size": 10}}},
+    ]}
+
+    assert parser.queued_images({"image_key": "data/interim/images/PnP/a/page_1.jpg", "size_bytes": 5}) == [
+        ("data/interim/images/PnP/a/page_1.jpg", 5)]
+    assert parser.queued_images(json.loads(json.dumps(notification))) == [
+        ("data/interim/images/PnP/Gauteng/Weekly Specials/page_3.jpg", 2048)]
+    assert parser.queued_images({"Service": "Amazon S3", "Event": "s3:TestEvent"}) == []
+
+
+class FakeContext:
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def jpeg_bytes(color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 96), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def parser(load_lambda):
+    with mock_aws():
+        boto3.client("s3", region_name="af-south-1").create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "af-south-1"})
+        yield load_lambda(PARSER, S3_BUCKET_NAME=BUCKET, GEMINI_FAKE_CLIENT="true",
+                          CONTEXT_CACHE_MIN_TOKENS="0", BATCH_PAGES="1")
+
+
+def test_empty_answer_settles_page_on_first_delivery(parser):
+    keys = [f"data/interim/images/PnP/Gauteng/Weekly/page_{n}.jpg" for n in (1, 2)]
+    for key, color in zip(keys, ("white", "black")):
+        parser.s3_client.put_object(Bucket=BUCKET, Key=key, Body=jpeg_bytes(color))
+    queue = parser.LocalWorkQueue(max_receives=1)
+
+    queue.send(keys)
+    parser.drain_local_queue(queue, FakeContext(300), workers=2)
+
+    assert queue.dead_letters == []
+    for key in keys:
+        body = parser.s3_client.get_object(Bucket=BUCKET, Key=parser.output_key_for(key))["Body"].read()
+        assert json.loads(body) == []
+
+
+def test_deferred_pages_do_not_use_up_receives(parser):
+    key = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+    parser.s3_client.put_object(Bucket=BUCKET, Key=key, Body=jpeg_bytes())
+    parser.latency.record(parser.MODELS[0], 0, 20.0)
+    queue = parser.LocalWorkQueue(max_receives=1)
+    queue.send([key])
+
+    # Too little time left to start the page: it goes back as a new message, not a nack
+    assert parser.work_items(queue.receive(), FakeContext(25), timeout_seconds=300) == ([], [key], [])
+    queue.send([key])
+    assert parser.work_items(queue.receive(), FakeContext(300)) == ([], [], [])
+    assert queue.dead_letters == []
+
+
+
+def test_fake_client_reports_cached_prompt_tokens(parser):
+    part = parser.types.Part.from_bytes(data=jpeg_bytes(), mime_type="image/jpeg")
+
+    for _ in range(2):
+        parser.run_cascade(part, 1000, parser.MODELS[:1], "page_1")
+
+    assert parser.prompt_cache.tokens["calls"] == 2
+    assert parser.prompt_cache.tokens["cached"] == 2 * (len(parser.SYSTEM_INSTRUCTION) // 4)
+
+
+def test_large_box_alone_does_not_saturate_score(load_lambda):
+    parser = load_lambda(PARSER)
+    one_box = [{"product_name": "Coke 2L", "current_price": "R19.99", "bounding_box": [0, 0, 600, 600]}]
+    grid = [{"product_name": f"Item {row}-{col}", "current_price": "R9.99",
+             "bounding_box": [row * 300, col * 300, row * 300 + 280, col * 300 + 280]}
+            for row in range(3) for col in range(3)]
+
+    assert parser.score_products(one_box, "product_grid") < parser.CASCADE_MIN_SCORE
+    assert parser.score_products(one_box, "unknown") < parser.CASCADE_MIN_SCORE
+    assert parser.score_products(one_box, "cover") >= parser.CASCADE_MIN_SCORE
+    assert parser.score_products(grid, "product_grid") >= parser.CASCADE_MIN_SCORE
+
+
+def test_few_large_products_pass_on_a_hero_page(load_lambda):
+    parser = load_lambda(PARSER)
+    # Three priced products side by side, together covering 80% of a product grid page
+    hero = [{"product_name": f"Hero {n}", "current_price": "R49.99", "bounding_box": [100, n * 333, 900, n * 333 + 333]}
+            for n in range(3)]
+
+    assert parser.score_products(hero, "product_grid") >= parser.CASCADE_MIN_SCORE
+
+
+LEFT_TILE, RIGHT_TILE = (0, 0, 550, 1000), (450, 0, 1000, 1000)
+
+
+def item(name, price, box, group_id=None):
+    return {"product_name": name, "current_price": price, "bounding_box": box, "group_id": group_id}
+
+
+def test_tile_merge_joins_seam_duplicates_and_their_groups(load_lambda):
+    parser = load_lambda(PARSER)
+    left = [item("Doritos 150g", "R25", [100, 800, 300, 1000], 1), item("Lays 120g", "R25", [400, 820, 600, 1000], 1)]
+    right = [item("doritos  150G", "R25", [100, 0, 300, 180], 1), item("Simba 120g", "R25", [700, 0, 900, 180], 1)]
+
+    merged = parser.merge_tile_products([(LEFT_TILE, left), (RIGHT_TILE, right)], 1000, 1000)
+
+    assert [p["product_name"] for p in merged] == ["Doritos 150g", "Lays 120g", "Simba 120g"]
+    assert merged[0]["bounding_box"] == [100, 440, 300, 550]
+    assert len({p["group_id"] for p in merged}) == 1
+
+
+def test_tile_merge_keeps_multibuy_and_same_price_products_apart(load_lambda):
+    parser = load_lambda(PARSER)
+    # All 3 for R75 inside one tile, plus a different R25 product across the seam
+    left = [item("Doritos 150g", "R25", [100, 800, 300, 1000], 7), item("Doritos 150g", "R25", [120, 810, 310, 1000], 7),
+            item("Lays 120g", "R25", [400, 820, 600, 1000], 7)]
+    right = [item("Simba 120g", "R25", [400, 0, 600, 180])]
+
+    merged = parser.merge_tile_products([(LEFT_TILE, left), (RIGHT_TILE, right)], 1000, 1000)
+
+    assert [p["product_name"] for p in merged] == ["Doritos 150g", "Doritos 150g", "Lays 120g", "Simba 120g"]
+
+
+def test_tile_merge_ignores_same_name_outside_the_overlap_band(load_lambda):
+    parser = load_lambda(PARSER)
+    left = [item("Coke 2L", "R20", [0, 0, 200, 300])]
+    right = [item("Coke 2L", "R20", [0, 500, 200, 800])]
+
+    merged = parser.merge_tile_products([(LEFT_TILE, left), (RIGHT_TILE, right)], 1000, 1000)
+
+    assert len(merged) == 2
+
+
+def test_key_health_is_only_read_for_gemini_calls(parser):
+    key = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+    parser.s3_client.put_object(Bucket=BUCKET, Key=parser.output_key_for(key), Body=b"[]")
+    event = {"Records": [{"s3": {"object": {"key": key}}}]}
+
+    parser.lambda_handler(event, FakeContext(300))
+    assert not parser.health._loaded
+
+    parser.health.begin_invocation()
+    part = parser.types.Part.from_bytes(data=jpeg_bytes(), mime_type="image/jpeg")
+    parser.run_cascade(part, 1000, parser.MODELS[:1], "page_2")
+    assert parser.health._loaded
+
+
+def test_local_batch_runs_submit_and_collect_on_local_files(load_lambda, tmp_path, monkeypatch):
+    parser = load_lambda(PARSER)
+    monkeypatch.chdir(tmp_path)
+    done = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+    pending = "data/interim/images/PnP/Gauteng/Weekly/page_2.jpg"
+    for key in (done, pending):
+        (tmp_path / key).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / key).write_bytes(jpeg_bytes())
+    (tmp_path / parser.output_key_for(done)).parent.mkdir(parents=True)
+    (tmp_path / parser.output_key_for(done)).write_text("[]")
+    products = [{"product_name": "Coke 2L", "current_price": "R19.99", "bounding_box": [0, 0, 300, 300]}]
+    (tmp_path / "fixtures.json").write_text(json.dumps({pending: products}))
+
+    display_name = parser.run_local_batch("data/interim/images/PnP/Gauteng", "fixtures.json")
+
+    assert json.loads((tmp_path / parser.output_key_for(pending)).read_text()) == products
+    requests = (tmp_path / "data/interim/batch_jobs" / display_name / "requests.jsonl").read_text().splitlines()
+    assert [json.loads(line)["key"] for line in requests] == [pending]
+    assert "file_data" in json.loads(requests[0])["request"]["contents"][0]["parts"][0]
+    assert not (tmp_path / parser.BATCH_JOB_PREFIX / f"{display_name}.json").exists()
+    assert json.loads((tmp_path / parser.BATCH_DONE_PREFIX / f"{display_name}.json").read_text())["state"] == "JOB_STATE_SUCCEEDED"
+    assert parser.poll_batch_jobs(parser.LocalBatchEndpoint("data/interim/batch_jobs")) == {}
+
+
+def test_queue_workers_share_each_keys_quota(load_lambda):
+    parser = load_lambda(PARSER, PARSER_WORKERS="4")
+    model_id = "gemini-2.5-flash-lite"
+
+    rpm, tpm = parser.scheduler._pair_buckets(0, model_id)
+
+    assert rpm.capacity * 4 == parser.MODEL_LIMITS[model_id]["rpm"]
+    assert tpm.capacity * 4 == parser.MODEL_LIMITS[model_id]["tpm"]
+
+
+def test_tiled_empty_page_settles_without_full_cascades(load_lambda):
+    with mock_aws():
+        boto3.client("s3", region_name="af-south-1").create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "af-south-1"})
+        parser = load_lambda(PARSER, S3_BUCKET_NAME=BUCKET, GEMINI_FAKE_CLIENT="true", TILE_MODE="all")
+        key = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+        parser.s3_client.put_object(Bucket=BUCKET, Key=key, Body=jpeg_bytes())
+
+        assert parser.process_image(key) == "empty"
+
+        body = parser.s3_client.get_object(Bucket=BUCKET, Key=parser.output_key_for(key))["Body"].read()
+        assert json.loads(body) == []
+        # Four tiles, each settled after at most one escalation
+        assert parser.prompt_cache.tokens["calls"] == 4 * (parser.TILE_EMPTY_ESCALATIONS + 1)
+
+
+def test_tile_merge_never_leaves_tile_local_boxes(load_lambda):
+    parser = load_lambda(PARSER)
+    left = [item("Coke 2L", "R20", [100, 900, 300, 1040]), item("Fanta 2L", "R20", [300, 200, 100, 400])]
+
+    merged = parser.merge_tile_products([(LEFT_TILE, left)], 1000, 1000)
+
+    assert merged[0]["bounding_box"] == [100, 495, 300, 550]
+    assert "bounding_box" not in merged[1]
+
+
+def test_invocation_reports_start_over_but_escalation_history_stays(parser):
+    parser.record_cascade(parser.MODELS[0], "escalated", 2.0)
+    parser.parse_cache_stats["hits"] += 1
+    parser.prompt_cache.tokens["calls"] += 1
+
+    parser.lambda_handler({"Records": []}, FakeContext(300))
+
+    assert parser.cascade_stats == {}
+    assert parser.parse_cache_stats == {"hits": 0, "misses": 0}
+    assert parser.prompt_cache.tokens["calls"] == 0
+    assert parser.health.stats["ok"] == 0
+    assert parser.escalation_history[parser.MODELS[0]] == {"attempts": 1, "escalated": 1}
+
+
+def test_same_page_in_another_province_waits_for_the_claimed_parse(parser):
+    import hashlib
+    gauteng = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+    western_cape = "data/interim/images/PnP/Western_Cape/Weekly/page_1.jpg"
+    image = jpeg_bytes()
+    for key in (gauteng, western_cape):
+        parser.s3_client.put_object(Bucket=BUCKET, Key=key, Body=image)
+    image_hash = hashlib.sha256(image).hexdigest()
+    assert parser.claim_parse(image_hash, gauteng)
+
+    assert parser.work_items([western_cape], FakeContext(300)) == ([], [], [western_cape])
+    assert parser.prompt_cache.tokens["calls"] == 0
+
+    parser.store_parse_cache(image_hash, parser.MODELS[0], [])
+    parser.release_parse_claim(image_hash)
+    parser._parse_cache.clear()
+    assert parser.work_items([western_cape], FakeContext(300)) == ([], [], [])
+    assert parser.prompt_cache.tokens["calls"] == 0
+
+
+
+def test_local_drain_near_the_deadline_stops_instead_of_starting(parser):
+    key = "data/interim/images/PnP/Gauteng/Weekly/page_1.jpg"
+    parser.s3_client.put_object(Bucket=BUCKET, Key=key, Body=jpeg_bytes())
+    parser.latency.record(parser.MODELS[0], 0, 20.0)
+    queue = parser.LocalWorkQueue()
+    queue.send([key])
+
+    # Little time is left, but the invocation started with 300s: the page waits
+    parser.drain_local_queue(queue, FakeContext(25), workers=1, timeout_seconds=300)
+
+    assert queue.pending_count() == 1
+    assert parser.prompt_cache.tokens["calls"] == 0
+
+
+def test_slow_cache_creation_only_blocks_its_own_key_and_model(load_lambda):
+    import threading
+    parser = load_lambda(PARSER, CONTEXT_CACHE_MIN_TOKENS="0")
+    release = threading.Event()
+
+    class SlowClient(parser.FakeGenaiClient):
+        def create(self, model, config):
+            release.wait(5)
+            return super().create(model, config)
+
+    slow = threading.Thread(target=parser.prompt_cache.handle, args=(SlowClient(), 0, parser.MODELS[0]))
+    slow.start()
+    try:
+        started = time.monotonic()
+        assert parser.prompt_cache.handle(parser.FakeGenaiClient(), 1, parser.MODELS[0])
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        slow.join()
+    assert parser.prompt_cache.handle(parser.FakeGenaiClient(), 0, parser.MODELS[0])